@@ -0,0 +1,152 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager, contextmanager
+from answer_cache import normalize
+import metrics
+
+ADMITTED = "admitted"
+DUPLICATE = "duplicate"  # the same question from the same user is already being answered
+THROTTLED_USER = "throttled_user"
+THROTTLED_GLOBAL = "throttled_global"
+
+# Lower runs first
+PRIORITY_DM = 0
+PRIORITY_SHORT = 1
+PRIORITY_LONG = 2
+
+
+class TokenBucket:
+    """`rate` tokens per second, at most `capacity` saved up for bursts."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self):
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def refund(self):
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+    def full(self):
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class AdmissionController:
+    """Decides whether a Gemini request may go out.
+
+    Each user has a token bucket (`user_rpm` requests per minute, bursts of
+    `user_burst`) and the whole bot shares one (`global_rpm`, `global_burst`).
+    A prompt identical (once normalized) to one of the same user's requests
+    still in flight is not sent again.
+    """
+
+    def __init__(self, user_rpm=6, user_burst=3, global_rpm=60, global_burst=15):
+        self.user_rpm = user_rpm
+        self.user_burst = user_burst
+        self._global = TokenBucket(global_rpm / 60, global_burst)
+        self._users = {}
+        self._in_flight = set()
+        self.counts = {ADMITTED: 0, DUPLICATE: 0, THROTTLED_USER: 0, THROTTLED_GLOBAL: 0}
+
+    def _admit(self, user_id, key):
+        if key in self._in_flight:
+            return DUPLICATE
+        bucket = self._users.get(user_id)
+        if bucket is None:
+            bucket = self._users[user_id] = TokenBucket(self.user_rpm / 60, self.user_burst)
+        if not bucket.try_acquire():
+            return THROTTLED_USER
+        if not self._global.try_acquire():
+            bucket.refund()
+            return THROTTLED_GLOBAL
+        return ADMITTED
+
+    @contextmanager
+    def request(self, user_id, prompt):
+        """Yields ADMITTED, DUPLICATE, THROTTLED_USER or THROTTLED_GLOBAL."""
+        key = (user_id, normalize(prompt))
+        status = self._admit(user_id, key)
+        self.counts[status] += 1
+        metrics.inc("gemini_admission_total", status=status)
+        if status != ADMITTED:
+            yield status
+            return
+        self._in_flight.add(key)
+        try:
+            yield status
+        finally:
+            self._in_flight.discard(key)
+
+    async def prune(self):
+        # Users whose bucket is full again don't need one anymore. A coroutine so the
+        # scheduler runs it on the event loop, never at the same time as an admission.
+        for user_id in [u for u, bucket in self._users.items() if bucket.full()]:
+            del self._users[user_id]
+
+
+class PriorityGate:
+    """Semaphore whose waiters are woken by priority (then arrival order)."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.in_use = 0
+        self._waiters = []  # heap of (priority, seq, future)
+        self._seq = itertools.count()
+
+    def depth(self):
+        return len(self._waiters)
+
+    @asynccontextmanager
+    async def slot(self, priority=PRIORITY_SHORT):
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, priority=PRIORITY_SHORT):
+        start = time.perf_counter()
+        if self.in_use >= self.capacity or self._waiters:
+            future = asyncio.get_running_loop().create_future()
+            entry = (priority, next(self._seq), future)
+            heapq.heappush(self._waiters, entry)
+            metrics.set_gauge("gemini_queue_depth", len(self._waiters))
+            try:
+                await future  # the slot is handed over by _release
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    self.release()  # got the slot just as we were cancelled
+                else:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                raise
+        else:
+            self.in_use += 1
+        metrics.observe("gemini_queue_wait_seconds", time.perf_counter() - start, priority=priority)
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)  # in_use stays the same: the slot changes hands
+                metrics.set_gauge("gemini_queue_depth", len(self._waiters))
+                return
+        self.in_use -= 1
+        metrics.set_gauge("gemini_queue_depth", 0)
@@ -0,0 +1,153 @@
+import asyncio
+import calendar
+import json
+import logging
+import os
+import time
+from datetime import date
+import metrics
+
+DEFAULT_TEMPLATES = {
+    "birthday": "🎉 Happy Birthday {name}! 🎂",
+}
+
+
+def parse_date(raw_date):
+    """(year or None, month, day) of YYYY-MM-DD, MM-DD or (as typed in the sheets) D/M/YYYY."""
+    if "/" in raw_date:
+        day, month, *year = map(int, raw_date.split("/"))
+    else:
+        *year, month, day = map(int, raw_date.split("-"))
+    if len(year) > 1:
+        raise ValueError(f"too many parts in {raw_date!r}")
+    date(2000, month, day)  # raises ValueError on an impossible date (2000 is a leap year, so 02-29 is fine)
+    return (year[0] if year else None), month, day
+
+
+def parse_event(event):
+    """(user_id, month, day, kind, year) of one entry, or None if it's incomplete.
+
+    An entry gives the user either directly (`user_id`) or through an
+    environment variable (`user_env`), and its `date` (see `parse_date`).
+    """
+    user_id = event.get("user_id") or os.getenv(event.get("user_env", ""))
+    raw_date = str(event.get("date", "")).strip()
+    if not user_id or not raw_date:
+        logging.error(f"❌ Anniversary without user or date: {event}")
+        return None
+    try:
+        year, month, day = parse_date(raw_date)
+    except ValueError:
+        logging.error(f"❌ Invalid anniversary date {raw_date!r} for {user_id}")
+        return None
+    return int(user_id), month, day, event.get("kind", "birthday"), year
+
+
+class Anniversaries:
+    """Birthdays and other yearly events, indexed by (month, day).
+
+    Today's events are a single dict lookup whatever the number of learners,
+    and only those users are resolved (from the client cache, else fetched
+    once and kept). Wishes are sent as DMs concurrently, at most
+    `max_concurrency` at a time. `now()` gives the current time in the bot's
+    timezone. People born on February 29 are celebrated on the 28th in other years.
+    With several bot processes, `claim(user_id, day)` must return True for the
+    one that sends the wish (see job_claims.JobClaims).
+    """
+
+    def __init__(self, bot, path, now, max_concurrency=10, claim=None):
+        self.bot = bot
+        self.claim = claim
+        self.path = path
+        self.now = now
+        self.max_concurrency = max_concurrency
+        self.send_time = "09:00"
+        self.templates = dict(DEFAULT_TEMPLATES)
+        self.by_day = {}  # (month, day) -> [(user_id, kind, year)]
+        self._file_events = []
+        self._sheet_events = []
+        self._users = {}  # user_id -> discord.User
+        self._mtime = None
+        self.sent = 0
+        self.failed = 0
+        self.reload()
+
+    def _index(self):
+        by_day = {}
+        for event in self._file_events + self._sheet_events:
+            parsed = parse_event(event)
+            if parsed:
+                user_id, month, day, kind, year = parsed
+                by_day.setdefault((month, day), []).append((user_id, kind, year))
+        self.by_day = by_day
+        logging.info(f"🎂 {sum(map(len, by_day.values()))} anniversaries loaded")
+
+    def reload(self):
+        if not os.path.exists(self.path):
+            logging.warning(f"No anniversaries file at {self.path}")
+            return
+        with open(self.path, encoding="utf-8") as f:
+            config = json.load(f)
+        self.send_time = config.get("send_time", self.send_time)
+        self.templates = {**DEFAULT_TEMPLATES, **config.get("templates", {})}
+        self._file_events = config.get("events", [])
+        self._mtime = os.path.getmtime(self.path)
+        self._index()
+
+    def reload_if_changed(self):
+        if os.path.exists(self.path) and os.path.getmtime(self.path) != self._mtime:
+            self.reload()
+            return True
+        return False
+
+    def set_records(self, records):
+        """Events from a spreadsheet (rows as dicts with user_id, date and optionally kind)."""
+        self._sheet_events = [{key.strip().lower().replace(" ", "_"): value for key, value in record.items()} for record in records]
+        self._index()
+
+    def due(self, day):
+        events = list(self.by_day.get((day.month, day.day), []))
+        if (day.month, day.day) == (2, 28) and not calendar.isleap(day.year):
+            events += self.by_day.get((2, 29), [])
+        return events
+
+    async def user(self, user_id):
+        if user_id not in self._users:
+            user = self.bot.get_user(user_id) or await self.bot.fetch_user(user_id)
+            self._users[user_id] = user
+        return self._users[user_id]
+
+    async def _send(self, semaphore, day, user_id, kind, year):
+        if self.claim and not self.claim(user_id, day):
+            return
+        try:
+            async with semaphore:
+                user = await self.user(user_id)
+                template = self.templates.get(kind, self.templates["birthday"])
+                message = template.format(name=user.name, mention=user.mention, years=day.year - year if year else "")
+                with metrics.timer("discord_send_seconds", op="anniversary"):
+                    await user.send(message)
+            self.sent += 1
+            logging.info(f"Sent {kind} wish to {user.name}!")
+        except Exception as e:
+            self.failed += 1
+            logging.error(f"❌ Could not send the {kind} wish to {user_id}: {e}")
+
+    @metrics.timed("scheduled_job_seconds", job="anniversaries")
+    async def send_today(self):
+        day = self.now().date()
+        events = self.due(day)
+        if not events:
+            return 0
+        start = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        await asyncio.gather(*(self._send(semaphore, day, *event) for event in events))
+        logging.info(f"🎂 {len(events)} anniversary wishes sent in {time.perf_counter() - start:.2f}s")
+        return len(events)
+
+    def register_job(self, scheduler, timezone=None):
+        # One exact cron job a day, in `timezone` (the one of `now()`), else the scheduler's
+        hour, minute = self.send_time.split(":")
+        scheduler.add_job(self.send_today, 'cron', hour=hour, minute=minute, timezone=timezone or scheduler.timezone,
+                          id="anniversaries", replace_existing=True)
+
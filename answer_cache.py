@@ -0,0 +1,115 @@
+import difflib
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from chat_store import to_turn
+
+_MENTION = re.compile(r"<@[!&]?\d+>")
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_SPACES = re.compile(r"\s+")
+_NUMBERS = re.compile(r"\d+")
+# Questions about the asker ("how old am i", "my grades") have a different answer for each learner
+_PERSONAL = re.compile(r"\b(i|im|ive|id|ill|me|my|mine|myself)\b")
+
+
+def normalize(prompt):
+    # "<@123> Where's the Moodle link ??" -> "wheres the moodle link"
+    text = _MENTION.sub(" ", prompt).lower()
+    text = _PUNCTUATION.sub("", text)
+    return _SPACES.sub(" ", text).strip()
+
+
+def is_personal(question):
+    return _PERSONAL.search(question) is not None
+
+
+def conversation_key(history):
+    # Short hash of the last exchange: "why?" or "give me an example" only shares an
+    # answer with conversations at the same point ("" for a first question)
+    last = [to_turn(msg) for msg in list(history)[-2:]]
+    return hashlib.sha1(repr(last).encode("utf-8")).hexdigest()[:12] if last else ""
+
+
+class AnswerCache:
+    """Gemini answers to repeated questions, keyed on (normalized prompt, context version).
+
+    The context version is whatever the answer depends on (e.g. the day,
+    today's tech talk and the asker's last exchange, see `conversation_key`),
+    so a new version never serves a stale or out-of-context answer. Entries
+    expire after `ttl` seconds and the least recently used are dropped past
+    `max_size`. Answers are shared between learners, so questions about the
+    asker (first person) are never cached. With `fuzzy_threshold` set, a
+    near-identical question (difflib ratio above the threshold, same numbers)
+    with the same context version is a hit too.
+    """
+
+    def __init__(self, max_size=500, ttl=3600, fuzzy_threshold=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.fuzzy_threshold = fuzzy_threshold
+        self._entries = OrderedDict()  # (question, version) -> (answer, stored_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[1] > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def _fuzzy_lookup(self, question, version, threshold):
+        matcher = difflib.SequenceMatcher(b=question)
+        numbers = _NUMBERS.findall(question)
+        for key in reversed(self._entries):
+            candidate, candidate_version = key
+            # "is 2024 a leap year" is not "is 2021 a leap year", however similar the text
+            if candidate_version != version or _NUMBERS.findall(candidate) != numbers:
+                continue
+            matcher.set_seq1(candidate)
+            if (matcher.real_quick_ratio() >= threshold
+                    and matcher.quick_ratio() >= threshold
+                    and matcher.ratio() >= threshold):
+                return self._lookup(key)
+        return None
+
+    def get(self, prompt, version="", fuzzy_threshold=None):
+        # `fuzzy_threshold` overrides the cache's own for this lookup (e.g. looser when Gemini is down)
+        question = normalize(prompt)
+        if is_personal(question):
+            return None
+        threshold = fuzzy_threshold or self.fuzzy_threshold
+        with self._lock:
+            answer = self._lookup((question, version))
+            if answer is None and threshold:
+                answer = self._fuzzy_lookup(question, version, threshold)
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return answer
+
+    def put(self, prompt, version, answer):
+        question = normalize(prompt)
+        if not question or not answer or is_personal(question):
+            return
+        with self._lock:
+            self._entries[(question, version)] = (answer, time.monotonic())
+            self._entries.move_to_end((question, version))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,271 @@
+"""In-process stand-ins for Discord, Gemini and gspread, used by the benchmarks.
+
+Nothing here touches the network: latencies are simulated with sleeps
+(blocking ones for Gemini and gspread, like the real clients).
+"""
+import asyncio
+import itertools
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date
+import discord
+
+_ids = itertools.count(1000)
+
+
+# --- Gemini -------------------------------------------------------------------
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeChatSession:
+    """Mimics genai.ChatSession: blocking send_message, history of {"role", "parts"} dicts."""
+
+    def __init__(self, model, history):
+        self.model = model
+        self.history = list(history or [])
+
+    def send_message(self, prompt, stream=False, request_options=None):
+        self.model.calls += 1
+        timeout = (request_options or {}).get("timeout")
+        stalled = self.model.random.random() < self.model.slow_rate
+        failed = self.model.random.random() < self.model.error_rate
+        reply = ("lorem ipsum " * (self.model.reply_size // 12 + 1))[:self.model.reply_size]
+        if not stream:
+            with self.model.busy():
+                self._start(stalled, failed, timeout)
+                time.sleep(self.model.latency)
+                self._remember(prompt, reply)
+                return FakeResponse(reply)
+        return self._stream(prompt, reply, stalled, failed, timeout)
+
+    def _start(self, stalled, failed, timeout):
+        if stalled:
+            # Stalled before the first token, until the request's timeout if it has one
+            if timeout is not None and timeout < self.model.slow_latency:
+                time.sleep(timeout)
+                raise TimeoutError("fake Gemini timeout")
+            time.sleep(self.model.slow_latency)
+        if failed:
+            time.sleep(self.model.latency)
+            raise RuntimeError("fake Gemini error")
+
+    def _remember(self, prompt, reply):
+        self.history += [{"role": "user", "parts": [prompt]}, {"role": "model", "parts": [reply]}]
+
+    def _stream(self, prompt, reply, stalled, failed, timeout, chunks=8):
+        with self.model.busy():
+            self._start(stalled, failed, timeout)
+            self._remember(prompt, reply)
+            size = len(reply) // chunks + 1
+            for i in range(0, len(reply), size):
+                time.sleep(self.model.latency / chunks)
+                yield FakeResponse(reply[i:i + size])
+
+
+class FakeModel:
+    """Mimics genai.GenerativeModel with a configurable latency, reply size and error rate.
+
+    A `slow_rate` share of the requests stall for `slow_latency` seconds before
+    answering (the tail that hedging is for), or until their request timeout.
+    `max_in_flight` is the most requests it was answering at once.
+    """
+
+    def __init__(self, latency=0.3, reply_size=600, error_rate=0.0, slow_rate=0.0, slow_latency=5.0):
+        self.latency = latency
+        self.reply_size = reply_size
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self.random = random.Random(0)  # same error sequence on every run
+
+    @contextmanager
+    def busy(self):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def start_chat(self, history=None):
+        return FakeChatSession(self, history)
+
+
+# --- gspread ------------------------------------------------------------------
+
+class FakeWorksheet:
+    """Two header rows like the tech-talk sheet, `rows` learners, one talk today.
+
+    Bump `revision` to simulate an edit of the sheet.
+    """
+
+    def __init__(self, rows=200, latency=0.5):
+        self.latency = latency
+        self.downloads = 0
+        self.revision = 1
+        today = date.today()
+        self.header1 = ["", "", "", "Feedback_", "", ""]
+        self.header2 = ["Date", "Learner", "Theme", "Voice", "Slides", "Body Language"]
+        self.rows = [
+            [f"{(i % 28) + 1}/{(i % 12) + 1}/{today.strftime('%y')}", f"Learner {i}", f"Theme {i}", "A", "B", "C"]
+            for i in range(rows)
+        ]
+        self.rows.append([today.strftime('%-d/%-m/%y'), "Ada", "Pandas tricks", "Bob", "Eve", "Tom"])
+
+    def get_all_values(self):
+        time.sleep(self.latency)
+        self.downloads += 1
+        return [self.header1, self.header2] + self.rows
+
+
+class FakeSpreadsheet:
+    def __init__(self, worksheet):
+        self.sheet1 = worksheet
+
+    def get_lastUpdateTime(self):
+        time.sleep(self.sheet1.latency / 4)
+        return f"2025-01-01T00:00:{self.sheet1.revision:02d}Z"
+
+
+class FakeSheetsClient:
+    def __init__(self, worksheet):
+        self._spreadsheet = FakeSpreadsheet(worksheet)
+
+    def spreadsheet(self, sheet_url):
+        return self._spreadsheet
+
+    def worksheet(self, sheet_url):
+        return self._spreadsheet.sheet1
+
+
+# --- Discord ------------------------------------------------------------------
+
+class FakeTyping:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeUser:
+    def __init__(self, name, user_id=None, bot=False):
+        self.id = user_id or next(_ids)
+        self.name = name
+        self.bot = bot
+        self.mention = f"<@{self.id}>"
+        self.sent = []
+
+    def __str__(self):
+        return self.name
+
+    def mentioned_in(self, message):
+        return any(user.id == self.id for user in message.mentions)
+
+    async def send(self, content):
+        self.sent.append(content)
+        return FakeMessage(content, self, None)
+
+
+class FakeRole:
+    def __init__(self, name):
+        self.id = next(_ids)
+        self.name = name
+        self.mention = f"<@&{self.id}>"
+
+
+class FakeGuild:
+    def __init__(self, role_names=()):
+        self.id = next(_ids)
+        self.roles = [FakeRole(name) for name in role_names]
+
+
+class FakeMessage:
+    def __init__(self, content, author, channel, mentions=()):
+        self.id = next(_ids)
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.mentions = list(mentions)
+        self.mention_everyone = False
+        self.edits = 0
+
+    async def edit(self, content=None):
+        await asyncio.sleep(self.channel.latency if self.channel else 0)
+        self.content = content
+        self.edits += 1
+        return self
+
+    async def reply(self, content):
+        return await self.channel.send(content)
+
+
+class _Sender:
+    latency = 0.05
+
+    async def send(self, content):
+        if len(content) > 2000:
+            raise ValueError("Must be 2000 or fewer in length.")
+        await asyncio.sleep(self.latency)
+        self.sent.append(content)
+        return FakeMessage(content, None, self)
+
+    def typing(self):
+        return FakeTyping()
+
+
+class FakeChannel(_Sender):
+    def __init__(self, name, guild=None, latency=0.05):
+        self.id = next(_ids)
+        self.name = name
+        self.guild = guild
+        self.latency = latency
+        self.sent = []
+
+    def __str__(self):
+        return self.name
+
+
+class FakeDMChannel(_Sender, discord.DMChannel):
+    """Passes the `isinstance(message.channel, discord.DMChannel)` check in on_message."""
+
+    def __init__(self, latency=0.05):
+        self.id = next(_ids)
+        self.latency = latency
+        self.sent = []
+
+    def __str__(self):
+        return "DM"
+
+
+class FakeBot:
+    """Just enough of discord.Client for get_channel lookups."""
+
+    def __init__(self, user):
+        self.user = user
+        self.channels = {}
+
+    def add_channel(self, channel):
+        self.channels[channel.id] = channel
+        return channel
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+    async def fetch_user(self, user_id):
+        await asyncio.sleep(0.05)
+        return FakeUser(f"user{user_id}", user_id)
+
+    def get_user(self, user_id):
+        return None
@@ -0,0 +1,278 @@
+"""Offline load test of the bot: python -m bench.run [--help]
+
+Drives main.py's real handlers (on_message, send_scheduled_message,
+save_user_chats) against the fakes in bench/fakes.py and reports throughput
+and p50/p99 latency per scenario. With --max-p99 the run fails (exit code 1)
+when a scenario is slower than the budget, to catch regressions before deploying.
+Callbacks that block the event loop are reported too (blocking_detector.py),
+and --max-blocked fails the run when a hot-path handler blocks it for longer.
+"""
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+from blocking_detector import BlockingDetector
+from bench.fakes import (FakeBot, FakeChannel, FakeDMChannel, FakeGuild, FakeMessage, FakeModel,
+                         FakeSheetsClient, FakeUser, FakeWorksheet)
+
+
+def setup(args, workdir):
+    """Import main.py with its external clients swapped for the fakes."""
+    os.environ.setdefault("DISCORD_TOKEN", "bench")
+    os.environ.setdefault("GEMINI_API", "bench")
+    os.environ.setdefault("CHANNEL_TEST_ID", "1")
+    os.environ["CHAT_STORE_PATH"] = os.path.join(workdir, "chats.db")
+    os.environ["TECHTALK_INDEX_PATH"] = os.path.join(workdir, "techtalks.db")
+    os.environ["JOB_CLAIMS_PATH"] = os.path.join(workdir, "jobs.db")
+    os.environ["GEMINI_WORKERS"] = str(args.workers)
+    os.environ["STREAM_EDIT_INTERVAL"] = str(args.edit_interval)
+    os.environ["STREAM_REPLIES"] = "1" if args.stream else "0"
+    os.environ["GEMINI_DEADLINE"] = str(args.deadline)
+    os.environ["GEMINI_HEDGE_AFTER"] = str(args.hedge_after)
+    if not args.rate_limits:
+        # Measure the pipeline itself, not the admission control in front of it
+        os.environ["GEMINI_USER_BURST"] = os.environ["GEMINI_GLOBAL_BURST"] = "1000000"
+
+    bot_user = FakeUser("BecodeBot", bot=True)
+    fake_bot = FakeBot(bot_user)
+    guild = FakeGuild([f"Cohort {i}" for i in range(args.cohorts)])
+    test_channel = fake_bot.add_channel(FakeChannel("test", guild, latency=args.discord_latency))
+
+    cohorts = []
+    for i in range(args.cohorts):
+        channel = fake_bot.add_channel(FakeChannel(f"cohort-{i}", guild, latency=args.discord_latency))
+        cohorts.append({"name": f"Cohort {i}", "channel_id": channel.id, "role_name": f"Cohort {i}",
+                        "moodle_link": "https://moodle.example/checkin", "techtalk": i % 2 == 0})
+    os.environ["COHORTS_FILE"] = os.path.join(workdir, "cohorts.json")
+    with open(os.environ["COHORTS_FILE"], "w") as f:
+        json.dump({"cohorts": cohorts}, f)
+
+    os.environ["ANNIVERSARIES_FILE"] = os.path.join(workdir, "anniversaries.json")
+    with open(os.environ["ANNIVERSARIES_FILE"], "w") as f:
+        json.dump({"events": []}, f)
+
+    import main
+    import sheets_utils
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    model_options = dict(latency=args.gemini_latency, reply_size=args.reply_size, error_rate=args.gemini_error_rate,
+                         slow_rate=args.gemini_slow_rate, slow_latency=args.gemini_slow_latency)
+    model = FakeModel(**model_options)
+    worksheet = FakeWorksheet(rows=args.sheet_rows, latency=args.sheets_latency)
+    main.model = model
+    # The hedge target: as fast as the main model, without its slow tail or errors
+    main.fallback_model = FakeModel(latency=args.gemini_latency, reply_size=args.reply_size)
+    main.fallback_model.busy = model.busy  # its calls count in the same peak of calls at once
+    if main.gemini_workers:
+        # The workers build their own fake model (their calls aren't counted in the report)
+        main.gemini_workers.model_factory = functools.partial(FakeModel, **model_options)
+        main.gemini_workers.start_method = "spawn"
+    sheets_utils.get_sheets_client = lambda json_keyfile_path: FakeSheetsClient(worksheet)
+    main.bot._connection.user = bot_user
+    main.bot.get_channel = fake_bot.get_channel
+    main.bot.fetch_user = fake_bot.fetch_user
+
+    async def process_commands(message):
+        pass
+    main.bot.process_commands = process_commands
+    main.CHANNEL_TEST_ID = test_channel.id
+
+    # Pretend it's a working Monday afternoon so every scheduled slot fires
+    monday = date.today() + timedelta(days=(7 - date.today().weekday()) % 7)
+    main.schedule.now = lambda: main.schedule.timezone.localize(datetime.combine(monday, datetime.min.time()).replace(hour=14))
+    return main, model, worksheet, bot_user
+
+
+def percentile(values, q):
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+async def timed_call(coro):
+    start = time.perf_counter()
+    await coro
+    return time.perf_counter() - start
+
+
+async def mention_storm(main, bot_user, args):
+    channel = FakeChannel("storm", FakeGuild(), latency=args.discord_latency)
+    users = [FakeUser(f"learner{i}") for i in range(args.users)]
+    messages = [
+        FakeMessage(f"{bot_user.mention} explain pandas groupby, question #{i}", users[i % len(users)], channel,
+                    mentions=[bot_user])
+        for i in range(args.mentions)
+    ]
+    return await asyncio.gather(*(timed_call(main.on_message(m)) for m in messages))
+
+
+FAQ = ["what time is it?", "when is the next check-in?", "where is the moodle link?", "what's today's tech talk?"]
+
+
+async def faq_storm(main, bot_user, args):
+    # The questions the intent router answers without Gemini
+    channel = FakeChannel("faq", FakeGuild(), latency=args.discord_latency)
+    users = [FakeUser(f"learner{i}") for i in range(args.users)]
+    messages = [
+        FakeMessage(f"{bot_user.mention} {FAQ[i % len(FAQ)]}", users[i % len(users)], channel, mentions=[bot_user])
+        for i in range(args.mentions)
+    ]
+    return await asyncio.gather(*(timed_call(main.on_message(m)) for m in messages))
+
+
+async def dm_burst(main, bot_user, args):
+    users = [FakeUser(f"learner{i}") for i in range(args.users)]
+    messages = [FakeMessage(f"hello, is there class today? #{i}", users[i % len(users)],
+                            FakeDMChannel(latency=args.discord_latency))
+                for i in range(args.dms)]
+    latencies = await asyncio.gather(*(timed_call(main.on_message(m)) for m in messages))
+    await main.dm_relay.flush()  # the staff digest, without waiting for the window
+    return latencies
+
+
+async def scheduled_ticks(main, bot_user, args):
+    latencies = []
+    for time_str in ["08:55", "11:00", "12:30", "13:25", "15:00", "17:00"][:args.ticks]:
+        latencies.append(await timed_call(main.send_scheduled_message(time_str)))
+    return latencies
+
+
+async def save_chats(main, bot_user, args):
+    for i in range(args.users):
+        chat = main.get_chat_for_user(f"saved{i}")
+        for turn in range(args.turns):
+            chat.history.append({"role": "user" if turn % 2 == 0 else "model", "parts": [f"turn {turn} " * 20]})
+    latencies = []
+    for _ in range(3):
+        start = time.perf_counter()
+        main.save_user_chats()
+        latencies.append(time.perf_counter() - start)
+        # A few users keep talking between two saves
+        for i in range(0, args.users, 10):
+            main.get_chat_for_user(f"saved{i}").history.append({"role": "user", "parts": ["one more"]})
+    return latencies
+
+
+SCENARIOS = {
+    "mention_storm": mention_storm,
+    "faq_storm": faq_storm,
+    "dm_burst": dm_burst,
+    "scheduled_tick": scheduled_ticks,
+    "save_user_chats": save_chats,
+}
+
+# Handlers learners wait on (save_user_chats is called synchronously by its scenario)
+HOT_PATH = ("on_message", "send_scheduled_message")
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as workdir:
+        main, model, worksheet, bot_user = setup(args, workdir)
+        detector = BlockingDetector(args.block_threshold, handler_modules=("main",))
+        if args.block_threshold:
+            detector.install()
+        results = []
+        for name in args.scenarios:
+            model.calls, worksheet.downloads = 0, 0
+            start = time.perf_counter()
+            latencies = await SCENARIOS[name](main, bot_user, args)
+            wall = time.perf_counter() - start
+            results.append((name, latencies, wall, model.calls, worksheet.downloads))
+        if args.verbose:
+            import metrics
+            print(metrics.summary())
+        if args.block_threshold:
+            detector.uninstall()
+        main.chat_store.close()
+        if main.gemini_workers:
+            main.gemini_workers.shutdown()
+    return results, detector, main
+
+
+def report(results, max_p99=None):
+    print(f"{'scenario':<18}{'n':>6}{'wall s':>9}{'ops/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}{'gemini':>8}{'sheets':>8}")
+    failed = []
+    for name, latencies, wall, calls, downloads in results:
+        p50, p99 = percentile(latencies, 50), percentile(latencies, 99)
+        print(f"{name:<18}{len(latencies):>6}{wall:>9.2f}{len(latencies) / wall:>9.1f}"
+              f"{p50 * 1000:>9.0f}{p99 * 1000:>9.0f}{max(latencies) * 1000:>9.0f}{calls:>8}{downloads:>8}")
+        if max_p99 is not None and p99 > max_p99:
+            failed.append(name)
+    if failed:
+        print(f"❌ p99 over budget ({max_p99}s): {', '.join(failed)}")
+    return not failed
+
+
+def report_blocking(detector, max_blocked=None):
+    print(detector.report())
+    failed = detector.over_budget(max_blocked, HOT_PATH) if max_blocked is not None else []
+    if failed:
+        print(f"❌ Event loop blocked over budget ({max_blocked}s) by: {', '.join(failed)}")
+    return not failed
+
+
+def report_in_flight(main, model):
+    # Hedges and abandoned attempts included; the workers' calls aren't seen from here
+    if main.gemini_workers:
+        return True
+    print(f"Gemini calls at once: max {model.max_in_flight} (GEMINI_MAX_IN_FLIGHT {main.GEMINI_MAX_IN_FLIGHT})")
+    if model.max_in_flight > main.GEMINI_MAX_IN_FLIGHT:
+        print("❌ More Gemini calls at once than GEMINI_MAX_IN_FLIGHT")
+        return False
+    return True
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark of the Discord bot")
+    parser.add_argument("scenarios", nargs="*", help=f"scenarios to run (default: all of {', '.join(SCENARIOS)})")
+    parser.add_argument("--mentions", type=int, default=50, help="mentions in the storm")
+    parser.add_argument("--dms", type=int, default=30, help="DMs in the burst")
+    parser.add_argument("--users", type=int, default=20, help="distinct learners")
+    parser.add_argument("--cohorts", type=int, default=30, help="cohort channels for the scheduled ticks")
+    parser.add_argument("--ticks", type=int, default=6, help="scheduled ticks to run (max 6)")
+    parser.add_argument("--turns", type=int, default=40, help="history turns per user for save_user_chats")
+    parser.add_argument("--gemini-latency", type=float, default=0.3)
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0, help="share of Gemini requests that fail")
+    parser.add_argument("--gemini-slow-rate", type=float, default=0.0, help="share of Gemini requests that are slow")
+    parser.add_argument("--gemini-slow-latency", type=float, default=5.0, help="latency (s) of the slow ones")
+    parser.add_argument("--deadline", type=float, default=30.0, help="GEMINI_DEADLINE for the run")
+    parser.add_argument("--hedge-after", type=float, default=1.0, help="GEMINI_HEDGE_AFTER for the run, 0 disables")
+    parser.add_argument("--reply-size", type=int, default=600, help="characters per Gemini reply")
+    parser.add_argument("--sheets-latency", type=float, default=0.5)
+    parser.add_argument("--sheet-rows", type=int, default=200)
+    parser.add_argument("--discord-latency", type=float, default=0.05)
+    parser.add_argument("--edit-interval", type=float, default=0.2, help="STREAM_EDIT_INTERVAL for the run")
+    parser.add_argument("--no-stream", dest="stream", action="store_false", help="send replies in one piece")
+    parser.add_argument("--workers", type=int, default=0, help="GEMINI_WORKERS (Gemini calls in worker processes)")
+    parser.add_argument("--rate-limits", action="store_true", help="keep the production Gemini rate limits")
+    parser.add_argument("--max-p99", type=float, help="fail if a scenario's p99 latency (s) is above this")
+    parser.add_argument("--block-threshold", type=float, default=0.05,
+                        help="report callbacks blocking the event loop longer than this (s), 0 disables")
+    parser.add_argument("--max-blocked", type=float,
+                        help=f"fail if {' or '.join(HOT_PATH)} blocks the event loop longer than this (s)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="also print the metrics summary")
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+    args.scenarios = args.scenarios or list(SCENARIOS)
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results, detector, main = asyncio.run(run(args))
+    ok = report(results, args.max_p99)
+    ok = report_in_flight(main, main.model) and ok
+    if args.block_threshold:
+        ok = report_blocking(detector, args.max_blocked) and ok
+    sys.exit(0 if ok else 1)
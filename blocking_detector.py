@@ -0,0 +1,180 @@
+import asyncio
+import itertools
+import logging
+import sys
+import threading
+import time
+import metrics
+
+# Every asyncio callback (task steps, call_soon, timers) goes through Handle._run
+_original_run = asyncio.events.Handle._run
+_detectors = {}  # loop -> BlockingDetector
+
+
+def _run(handle):
+    detector = _detectors.get(handle._loop)
+    if detector is None:
+        return _original_run(handle)
+    return detector._run(handle)
+
+
+def _await_chain(handle):
+    # Frames of the coroutines a task is awaiting on, outermost first
+    task = getattr(handle._callback, "__self__", None)
+    coro = task.get_coro() if isinstance(task, asyncio.Task) else None
+    frames = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None) or getattr(coro, "ag_frame", None)
+        if frame is None:
+            break
+        frames.append(frame)
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None) or getattr(coro, "ag_await", None)
+    return frames
+
+
+def _callback_stack(frame):
+    # Frames of the loop's thread above BlockingDetector._run, outermost first
+    frames = []
+    while frame is not None and frame.f_code is not BlockingDetector._run.__code__:
+        frames.append(frame)
+        frame = frame.f_back
+    return frames[::-1]
+
+
+class BlockedCall:
+    """What one handler did to the loop: how often and how long it blocked it, and its worst stack."""
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.stack = []
+
+    def add(self, duration, stack):
+        self.count += 1
+        self.total += duration
+        if duration >= self.max:
+            self.max = duration
+            self.stack = stack
+
+
+class BlockingDetector:
+    """Records the callbacks that hold the event loop for more than `threshold` seconds.
+
+    Each callback the loop runs is timed, and a watchdog thread takes a stack
+    sample of the loop's thread while one is running past the threshold, so the
+    report shows where it was stuck (the synchronous call), not only who it was.
+    Blocks are grouped by handler: the outermost function of `handler_modules`
+    on the stack (e.g. on_message, a scheduled job or a slash command in main.py).
+    Meant for development and test runs: every callback pays for the timing.
+    """
+
+    def __init__(self, threshold=0.1, handler_modules=("__main__",), sample_interval=None):
+        self.threshold = threshold
+        self.handler_modules = set(handler_modules)
+        self.sample_interval = sample_interval or threshold / 2
+        self.blocked = {}  # handler -> BlockedCall
+        self.loop = None
+        self._thread_id = None
+        self._ids = itertools.count()
+        self._current = None  # (id, start) of the callback running on the loop
+        self._samples = {}  # id -> frames sampled while it was running
+        self._stop = threading.Event()
+
+    def install(self, loop=None):
+        self.loop = loop or asyncio.get_running_loop()
+        self._thread_id = threading.get_ident()
+        _detectors[self.loop] = self
+        asyncio.events.Handle._run = _run
+        self._stop.clear()
+        threading.Thread(target=self._watch, name="blocking-detector", daemon=True).start()
+        logging.info(f"🐢 Blocking detector on: callbacks over {self.threshold * 1000:.0f}ms are reported")
+
+    def uninstall(self):
+        self._stop.set()
+        _detectors.pop(self.loop, None)
+        if not _detectors:
+            asyncio.events.Handle._run = _original_run
+
+    def _run(self, handle):
+        call_id = next(self._ids)
+        start = time.perf_counter()
+        self._current = (call_id, start)
+        try:
+            return _original_run(handle)
+        finally:
+            self._current = None
+            duration = time.perf_counter() - start
+            sample = self._samples.pop(call_id, None)
+            if duration >= self.threshold and not self._stop.is_set():
+                self._record(handle, duration, sample)
+
+    def _watch(self):
+        while not self._stop.wait(self.sample_interval):
+            current = self._current
+            if current is None or current[0] in self._samples:
+                continue
+            call_id, start = current
+            if time.perf_counter() - start < self.threshold:
+                continue
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is not None and self._current is current:
+                self._samples[call_id] = _callback_stack(frame)
+
+    def _handler(self, frames, handle):
+        for frame in frames:
+            if frame.f_globals.get("__name__") in self.handler_modules:
+                return frame.f_code.co_qualname
+        callback = getattr(handle._callback, "__self__", handle._callback)
+        if isinstance(callback, asyncio.Task):
+            return callback.get_name()
+        return getattr(callback, "__qualname__", repr(callback))
+
+    def _record(self, handle, duration, sample):
+        # Without a sample (too short to be caught), the stack is where the task is now suspended
+        frames = sample or _await_chain(handle)
+        handler = self._handler(frames, handle)
+        stack = [f"{frame.f_code.co_filename}:{frame.f_lineno} in {frame.f_code.co_qualname}" for frame in frames
+                 if "/asyncio/" not in frame.f_code.co_filename]
+        if handler not in self.blocked:
+            self.blocked[handler] = BlockedCall(handler)
+        self.blocked[handler].add(duration, stack)
+        metrics.observe("event_loop_blocked_seconds", duration, handler=handler)
+        logging.warning(f"🐢 {handler} blocked the event loop for {duration * 1000:.0f}ms"
+                        + (f" at {stack[-1]}" if stack else ""))
+
+    def over_budget(self, budget, handlers=None):
+        """Handlers (all, or those in `handlers`) that blocked the loop longer than `budget` seconds at once."""
+        return [call.handler for call in self.blocked.values()
+                if call.max > budget and (handlers is None or call.handler in handlers)]
+
+    def report(self):
+        if not self.blocked:
+            return f"No callback blocked the event loop over {self.threshold * 1000:.0f}ms"
+        lines = [f"Callbacks that blocked the event loop over {self.threshold * 1000:.0f}ms:"]
+        for call in sorted(self.blocked.values(), key=lambda call: call.max, reverse=True):
+            lines.append(f"{call.handler}: {call.count}x, max {call.max * 1000:.0f}ms, total {call.total * 1000:.0f}ms")
+            lines += [f"    {line}" for line in call.stack[-8:]]
+        return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    # Local check: a handler calling time.sleep is reported with the line that blocks,
+    # one awaiting asyncio.sleep is not.
+    async def on_message():
+        await asyncio.sleep(0.01)
+        time.sleep(0.3)  # blocking, like a synchronous HTTP call
+
+    async def well_behaved():
+        await asyncio.sleep(0.3)
+
+    async def demo():
+        detector = BlockingDetector(threshold=0.05)
+        detector.install()
+        await asyncio.gather(on_message(), well_behaved())
+        detector.uninstall()
+        print(detector.report())
+        print(f"over a 100ms budget: {detector.over_budget(0.1)}")
+
+    asyncio.run(demo())
@@ -0,0 +1,113 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import discord
+import metrics
+
+
+def load_cohorts(path):
+    """Enabled cohorts from the config file, with their channel id resolved.
+
+    A cohort gives its channel either directly (`channel_id`) or through an
+    environment variable (`channel_env`).
+    """
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+    cohorts = []
+    for cohort in config["cohorts"]:
+        if not cohort.get("enabled", True):
+            continue
+        channel_id = cohort["channel_id"] if "channel_id" in cohort else os.getenv(cohort.get("channel_env", ""))
+        if channel_id in (None, ""):
+            logging.error(f"❌ No channel configured for cohort {cohort.get('name')}")
+            continue
+        cohorts.append({**cohort, "channel_id": int(channel_id)})
+    return cohorts
+
+
+class Broadcaster:
+    """Sends the scheduled messages to every cohort channel at once.
+
+    Channels and role mentions are resolved once and cached until the guild's
+    roles change (see `invalidate`). At most `max_concurrency` sends run at the
+    same time so a big tick stays inside Discord's rate limits.
+    """
+
+    def __init__(self, bot, path, max_concurrency=10):
+        self.bot = bot
+        self.path = path
+        self.cohorts = load_cohorts(path)
+        self.max_concurrency = max_concurrency
+        self._resolved = {}  # channel_id -> (channel, role mention)
+        self.latencies = {}  # channel name -> seconds taken by the last send
+
+    def reload(self):
+        self.cohorts = load_cohorts(self.path)
+        self._resolved.clear()
+
+    def invalidate(self, guild_id=None):
+        # Called on role create/update/delete: forget what was resolved for that guild
+        if guild_id is None:
+            self._resolved.clear()
+            return
+        for channel_id, (channel, _) in list(self._resolved.items()):
+            if channel.guild is None or channel.guild.id == guild_id:
+                del self._resolved[channel_id]
+
+    def resolve(self, cohort):
+        channel_id = cohort["channel_id"]
+        if channel_id in self._resolved:
+            return self._resolved[channel_id]
+        channel = self.bot.get_channel(channel_id)
+        if not channel:
+            logging.error(f"❌ Channel with ID {channel_id} not found.")
+            return None, ""
+        role = discord.utils.get(channel.guild.roles, name=cohort["role_name"]) if channel.guild else None
+        if not role:
+            logging.warning(f"Role not found in {channel.name}")
+        self._resolved[channel_id] = (channel, role.mention if role else "")
+        return self._resolved[channel_id]
+
+    async def _send(self, semaphore, cohort, message_template, techtalk, claim):
+        channel_id = cohort["channel_id"]
+        try:
+            channel, role_mention = self.resolve(cohort)
+            if not channel or (claim and not claim(channel_id)):
+                return
+            message = message_template.format(role=role_mention, link=cohort["moodle_link"])
+            if cohort.get("techtalk") and techtalk:
+                message += techtalk
+            if not message:
+                return
+            async with semaphore:
+                start = time.perf_counter()
+                with metrics.timer("discord_send_seconds", op="broadcast"):
+                    await channel.send(message)
+                self.latencies[channel.name] = time.perf_counter() - start
+            logging.info(f"✅ Message sent to {channel.name} ({channel.id}) in {self.latencies[channel.name]:.2f}s")
+        except Exception as e:
+            logging.error(f"❌ Error sending message to channel {channel_id}: {e}")
+
+    def moodle_link(self, channel_id):
+        # Link of the cohort owning the channel, else the first cohort's
+        for cohort in self.cohorts:
+            if cohort["channel_id"] == channel_id:
+                return cohort["moodle_link"]
+        return self.cohorts[0]["moodle_link"] if self.cohorts else ""
+
+    def wants_techtalk(self):
+        return any(cohort.get("techtalk") for cohort in self.cohorts)
+
+    async def broadcast(self, message_template, techtalk="", claim=None):
+        """Send `message_template` (with {role} and {link}) to all cohorts concurrently.
+
+        With several bot processes, `claim(channel_id)` must return True for the
+        process that sends to that channel (see job_claims.JobClaims).
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        start = time.perf_counter()
+        await asyncio.gather(*(self._send(semaphore, cohort, message_template, techtalk, claim)
+                               for cohort in self.cohorts))
+        logging.info(f"📣 Broadcast to {len(self.cohorts)} channels in {time.perf_counter() - start:.2f}s")
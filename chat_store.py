@@ -0,0 +1,238 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+
+# str(part) on a Gemini Part gives `text: "..."` (protobuf text format), and the
+# old save/load round-trip wrapped it again in `[...]` on every restart.
+_WRAPPED_TEXT = re.compile(r'^\[?\s*text: "(.*)"\s*\]?$', re.DOTALL)
+_ESCAPE = re.compile(r"\\([0-7]{1,3}|.)", re.DOTALL)
+_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "'": "'", '"': '"', "\\": "\\"}
+
+
+def _unescape(text):
+    def replace(match):
+        code = match.group(1)
+        if code[0] in "01234567":
+            return chr(int(code, 8))
+        return _ESCAPES.get(code, "\\" + code)
+    return _ESCAPE.sub(replace, text)
+
+
+def clean_text(text):
+    """Strip every `[text: "..."]` layer added by the old save format."""
+    match = _WRAPPED_TEXT.match(text)
+    while match:
+        text = _unescape(match.group(1))
+        match = _WRAPPED_TEXT.match(text)
+    return text
+
+
+def part_text(part):
+    # Gemini parts (protos or dicts) and plain strings all end up as clean text
+    if isinstance(part, str):
+        return clean_text(part)
+    if isinstance(part, dict):
+        return clean_text(str(part.get("text", "")))
+    text = getattr(part, "text", None)
+    return clean_text(text if text is not None else str(part))
+
+
+def to_turn(msg):
+    # One history entry (Content proto or dict) -> {"role": ..., "parts": [text, ...]}
+    if isinstance(msg, dict):
+        role, parts = msg.get("role", "user"), msg.get("parts", [])
+    else:
+        role, parts = msg.role, msg.parts
+    if isinstance(parts, (str, dict)):
+        parts = [parts]
+    return {"role": role, "parts": [part_text(part) for part in parts]}
+
+
+class SQLiteChatStore:
+    """Chat history in SQLite, one row per turn.
+
+    Writes only append new turns (in one transaction), and a user's history is
+    only read when it's asked for. The file can be shared by several processes
+    (the Gemini workers, see worker_pool.py): it's in WAL mode and writers wait
+    for each other instead of failing.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS turns ("
+                " user_id TEXT NOT NULL, seq INTEGER NOT NULL, role TEXT NOT NULL, parts TEXT NOT NULL,"
+                " PRIMARY KEY (user_id, seq))"
+            )
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def load(self, user_id):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT role, parts FROM turns WHERE user_id = ? ORDER BY seq", (str(user_id),)
+            ).fetchall()
+        return [{"role": role, "parts": json.loads(parts)} for role, parts in rows]
+
+    def append(self, user_id, turns):
+        if not turns:
+            return 0
+        rows = [(turn["role"], json.dumps(turn["parts"], ensure_ascii=False)) for turn in turns]
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")  # no other process can append between MAX(seq) and INSERT
+            (last,) = self._conn.execute(
+                "SELECT COALESCE(MAX(seq), -1) FROM turns WHERE user_id = ?", (str(user_id),)
+            ).fetchone()
+            self._conn.executemany(
+                "INSERT INTO turns (user_id, seq, role, parts) VALUES (?, ?, ?, ?)",
+                [(str(user_id), last + 1 + i, role, parts) for i, (role, parts) in enumerate(rows)],
+            )
+        return sum(len(parts.encode("utf-8")) for _, parts in rows)
+
+    def is_empty(self):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM turns LIMIT 1").fetchone() is None
+
+    def drop_first_turn(self, turn):
+        """Delete `turn` wherever it is the first turn of a history; returns how many were deleted."""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "DELETE FROM turns WHERE seq = 0 AND role = ? AND parts = ?",
+                (turn["role"], json.dumps(turn["parts"], ensure_ascii=False)),
+            )
+        return cursor.rowcount
+
+    def migrated(self, name):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM meta WHERE key = ?", (f"migration:{name}",)).fetchone() is not None
+
+    def mark_migrated(self, name):
+        # One-shot data fixes record themselves here so they don't run on every startup
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO meta VALUES (?, 'done')", (f"migration:{name}",))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class JsonlChatStore:
+    """Append-only log: one JSON line per turn, fsynced after each batch.
+
+    The file is only read when a user's history is first needed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load(self, user_id):
+        user_id = str(user_id)
+        history = []
+        if not os.path.exists(self.path):
+            return history
+        with self._lock, open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # torn last line after a crash
+                if entry["user_id"] == user_id:
+                    history.append({"role": entry["role"], "parts": entry["parts"]})
+        return history
+
+    def append(self, user_id, turns):
+        if not turns:
+            return 0
+        data = "".join(
+            json.dumps({"user_id": str(user_id), **turn}, ensure_ascii=False) + "\n" for turn in turns
+        ).encode("utf-8")
+        with self._lock, open(self.path, "ab") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        return len(data)
+
+    def is_empty(self):
+        return not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+
+    def drop_first_turn(self, turn):
+        # The log is rewritten (to a temporary file, then renamed) only if there's something to drop
+        if self.is_empty():
+            return 0
+        seen, kept, dropped = set(), [], 0
+        with self._lock:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    first = entry["user_id"] not in seen
+                    seen.add(entry["user_id"])
+                    if first and entry["role"] == turn["role"] and entry["parts"] == turn["parts"]:
+                        dropped += 1
+                    else:
+                        kept.append(line)
+            if dropped:
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.writelines(kept)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+        return dropped
+
+    def _migrations(self):
+        # Done one-shot fixes, one name per line next to the log
+        path = self.path + ".migrations"
+        if not os.path.exists(path):
+            return set()
+        with open(path, encoding="utf-8") as f:
+            return {line.strip() for line in f}
+
+    def migrated(self, name):
+        return name in self._migrations()
+
+    def mark_migrated(self, name):
+        with self._lock, open(self.path + ".migrations", "a", encoding="utf-8") as f:
+            f.write(name + "\n")
+
+    def close(self):
+        pass
+
+
+def open_chat_store(path):
+    # The file extension picks the backend: *.jsonl is the append-only log, anything else SQLite
+    if path.endswith(".jsonl"):
+        return JsonlChatStore(path)
+    return SQLiteChatStore(path)
+
+
+def migrate_json(json_path, store):
+    """One-shot import of the old user_chats.json dump, with the parts un-nested."""
+    with open(json_path, encoding="utf-8") as f:
+        data = json.load(f)
+    turns = 0
+    for user_id, history in data.items():
+        cleaned = [to_turn(msg) for msg in history]
+        store.append(user_id, cleaned)
+        turns += len(cleaned)
+    logging.info(f"📥 Migrated {turns} turns for {len(data)} users from {json_path}")
+    return turns
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) != 3:
+        print("Usage: python chat_store.py user_chats.json chats.db")
+        sys.exit(1)
+    logging.basicConfig(level=logging.INFO)
+    migrate_json(sys.argv[1], open_chat_store(sys.argv[2]))
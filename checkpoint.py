@@ -0,0 +1,60 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+
+
+class CheckpointService:
+    """Periodically saves the chats that changed since the last checkpoint.
+
+    `mark_dirty(user_id)` is called whenever a user's history changes. A
+    checkpoint hands the dirty users to `save(user_id)` (which returns the bytes
+    written) in a worker thread, so the event loop never waits on the disk and
+    the cost follows activity, not the number of known users. Users for which
+    `is_busy(user_id)` is true (a Gemini call is running) wait for the next round.
+    """
+
+    def __init__(self, save, is_busy=None, interval=60):
+        self.save = save
+        self.is_busy = is_busy or (lambda user_id: False)
+        self.interval = interval
+        self._dirty = set()
+        self._lock = asyncio.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint")
+
+    def mark_dirty(self, user_id):
+        self._dirty.add(user_id)
+
+    def _write(self, users):
+        written, failed = 0, []
+        for user_id in users:
+            try:
+                written += self.save(user_id)
+            except Exception as e:
+                logging.error(f"❌ Checkpoint of {user_id} failed: {e}")
+                failed.append(user_id)
+        return written, failed
+
+    async def checkpoint(self, force=False):
+        async with self._lock:
+            users = {u for u in self._dirty if force or not self.is_busy(u)}
+            if not users:
+                return 0
+            self._dirty -= users
+            start = time.perf_counter()
+            loop = asyncio.get_running_loop()
+            written, failed = await loop.run_in_executor(self._executor, self._write, users)
+            self._dirty.update(failed)  # retried next time
+            duration = time.perf_counter() - start
+            metrics.observe("checkpoint_seconds", duration)
+            metrics.inc("checkpoint_bytes_total", written)
+            logging.info(f"💾 Checkpoint: {len(users) - len(failed)} chats, {written} bytes in {duration:.3f}s")
+            return written
+
+    async def flush(self, timeout=10):
+        """Save every dirty chat, giving up after `timeout` seconds (used on shutdown)."""
+        try:
+            await asyncio.wait_for(self.checkpoint(force=True), timeout)
+        except asyncio.TimeoutError:
+            logging.error(f"❌ Final checkpoint did not finish within {timeout}s, {len(self._dirty)} chats not saved")
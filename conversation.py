@@ -0,0 +1,162 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+import metrics
+
+
+def estimate_tokens(text):
+    # Rough rule of thumb for Gemini: ~4 characters per token
+    return len(text) // 4 + 1
+
+
+def turn_tokens(msg):
+    parts = msg["parts"] if isinstance(msg, dict) else msg.parts
+    if isinstance(parts, (str, dict)):
+        parts = [parts]
+    total = 0
+    for part in parts:
+        if isinstance(part, dict):
+            part = part.get("text", "")
+        total += estimate_tokens(part if isinstance(part, str) else getattr(part, "text", "") or "")
+    return total
+
+
+def fit_to_budget(history, token_budget):
+    """The history without its oldest exchanges, so that it fits in `token_budget`.
+
+    Turns are dropped by user/model pair so the roles keep alternating, and the
+    last exchange is always kept. The persona isn't part of the history (it's the
+    model's system instruction), so nothing else is pinned. Returns (history,
+    turns dropped, tokens dropped).
+    """
+    history = list(history)
+    sizes = [turn_tokens(msg) for msg in history]
+    total = sum(sizes)
+    start = 0
+    while total > token_budget and len(history) - start > 2:
+        total -= sizes[start] + sizes[start + 1]
+        start += 2
+    return history[start:], start, sum(sizes[:start])
+
+
+class ConversationManager:
+    """Keeps a bounded set of ChatSessions in memory.
+
+    - sessions idle for more than `idle_ttl` seconds are dropped,
+    - at most `max_sessions` sessions / `max_total_tokens` history tokens are kept (LRU),
+    - each history is trimmed to `token_budget` tokens before a request (oldest
+      exchanges first).
+
+    `load_chat(user_id)` builds a session on a miss, `on_evict(user_id, chat)` is
+    called before a session is dropped so it can be saved. Users for which
+    `is_busy(user_id)` is true (a Gemini request is queued or running) are kept
+    until it's done, so its exchange isn't lost with the session.
+    """
+
+    def __init__(self, load_chat, on_evict=None, max_sessions=200, idle_ttl=6 * 3600,
+                 max_total_tokens=2_000_000, token_budget=8000, is_busy=None):
+        self.load_chat = load_chat
+        self.on_evict = on_evict
+        self.is_busy = is_busy or (lambda user_id: False)
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_total_tokens = max_total_tokens
+        self.token_budget = token_budget
+        self.sessions = OrderedDict()  # user_id -> chat, least recently used first
+        self._last_used = {}
+        self._tokens = {}
+        self._lock = threading.RLock()
+        self.evictions = 0
+        self.trimmed_tokens = 0
+
+    def __contains__(self, user_id):
+        return user_id in self.sessions
+
+    def items(self):
+        with self._lock:
+            return list(self.sessions.items())
+
+    def get(self, user_id):
+        with self._lock:
+            chat = self.sessions.get(user_id)
+            if chat is None:
+                chat = self.load_chat(user_id)
+                self.sessions[user_id] = chat
+            self.sessions.move_to_end(user_id)
+            self._last_used[user_id] = time.monotonic()
+            self._tokens[user_id] = self.history_tokens(chat)
+            self._evict(keep=user_id)
+            self._record_tokens()
+            return chat
+
+    def history_tokens(self, chat):
+        return sum(turn_tokens(msg) for msg in chat.history)
+
+    def needs_trim(self, chat):
+        return self.history_tokens(chat) > self.token_budget
+
+    def trim(self, user_id, chat):
+        """Drop the oldest exchanges until the history fits in `token_budget` (see
+        `fit_to_budget`). Returns the number of turns removed.
+        """
+        history, dropped, dropped_tokens = fit_to_budget(chat.history, self.token_budget)
+        if not dropped:
+            return 0
+        with self._lock:
+            self.trimmed_tokens += dropped_tokens
+            self._tokens[user_id] = self.history_tokens(chat) - dropped_tokens
+            self._record_tokens()
+        metrics.inc("chat_trimmed_tokens_total", dropped_tokens)
+        chat.history = history
+        logging.info(f"✂️ Trimmed {dropped} turns (~{dropped_tokens} tokens) from {user_id}'s history")
+        return dropped
+
+    def _evict(self, keep=None):
+        now = time.monotonic()
+        total = sum(self._tokens.values())
+        for user_id in list(self.sessions):
+            if user_id == keep:
+                continue
+            idle = now - self._last_used.get(user_id, now) > self.idle_ttl
+            if not idle and len(self.sessions) <= self.max_sessions and total <= self.max_total_tokens:
+                break  # everything after this one is more recently used
+            if self.is_busy(user_id):
+                continue  # evicted on a later pass, once its request is done
+            total -= self._tokens.get(user_id, 0)
+            self.evict(user_id)
+
+    def evict(self, user_id):
+        with self._lock:
+            chat = self.sessions.pop(user_id, None)
+            self._last_used.pop(user_id, None)
+            self._tokens.pop(user_id, None)
+            if chat is None:
+                return
+            self.evictions += 1
+        if self.on_evict:
+            self.on_evict(user_id, chat)
+        logging.info(f"🧹 Evicted chat session of {user_id}")
+
+    def evict_idle(self):
+        with self._lock:
+            self._evict()
+            self._record_tokens()
+
+    def _record_tokens(self):
+        metrics.set_gauge("chat_history_tokens", sum(self._tokens.values()))
+
+    def report(self):
+        """Per-user history size: {user_id: (turns, estimated tokens)}."""
+        with self._lock:
+            return {user_id: (len(chat.history), self._tokens.get(user_id, 0))
+                    for user_id, chat in self.sessions.items()}
+
+    def summary(self, top=5):
+        # History tokens in memory, what trimming saved, and the `top` largest histories
+        report = self.report()
+        largest = sorted(report.items(), key=lambda item: item[1][1], reverse=True)[:top]
+        lines = [f"chat_history: ~{sum(tokens for _, tokens in report.values())} tokens in memory, "
+                 f"~{self.trimmed_tokens} trimmed"]
+        lines += [f"  {user_id}: {turns} turns, ~{tokens} tokens" for user_id, (turns, tokens) in largest]
+        return "\n".join(lines)
@@ -0,0 +1,82 @@
+import asyncio
+import logging
+import time
+import metrics
+from replies import send_long
+
+PING_EVERY = "every"  # ping staff in every digest
+PING_COOLDOWN = "cooldown"  # at most once per `ping_cooldown` seconds
+PING_NONE = "none"
+PING_POLICIES = (PING_EVERY, PING_COOLDOWN, PING_NONE)
+
+
+class DMRelay:
+    """Forwards the DMs learners send to the bot to the staff channel, in digests.
+
+    DMs are buffered for `window` seconds after the first one arrives, then
+    posted as a single message (split only if over Discord's limit), so a burst
+    of DMs costs one post and at most one round of pings instead of one each.
+    `get_channel()` returns the staff channel, or None if it can't be found.
+    """
+
+    def __init__(self, get_channel, window=5.0, pings=(), ping_policy=PING_EVERY, ping_cooldown=600):
+        if ping_policy not in PING_POLICIES:
+            raise ValueError(f"Unknown ping policy {ping_policy!r}, expected one of {', '.join(PING_POLICIES)}")
+        self.get_channel = get_channel
+        self.window = window
+        self.pings = [user_id for user_id in pings if user_id]
+        self.ping_policy = ping_policy
+        self.ping_cooldown = ping_cooldown
+        self._pending = []  # (author, content)
+        self._flush_task = None
+        self._last_ping = None
+        self.relayed = 0
+        self.digests = 0
+
+    def add(self, author, content):
+        self._pending.append((author, content))
+        metrics.inc("dm_relay_messages_total")
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        self._flush_task = None
+        await self.flush()
+
+    def _mentions(self):
+        if not self.pings or self.ping_policy == PING_NONE:
+            return ""
+        now = time.monotonic()
+        if self.ping_policy == PING_COOLDOWN and self._last_ping is not None and now - self._last_ping < self.ping_cooldown:
+            return ""
+        self._last_ping = now
+        return " ".join(f"<@{user_id}>" for user_id in self.pings) + " "
+
+    def digest(self, batch):
+        if len(batch) == 1:
+            author, content = batch[0]
+            return f"🤖 {self._mentions()}Private message received from {author}: {content}"
+        lines = [f"🤖 {self._mentions()}{len(batch)} private messages received:"]
+        lines += [f"• {author}: {content}" for author, content in batch]
+        return "\n".join(lines)
+
+    async def flush(self):
+        """Post what's buffered now (also used on shutdown)."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        channel = self.get_channel()
+        if channel is None:
+            logging.error(f"Le canal spécifié n'a pas été trouvé (pour test), {len(batch)} private messages not relayed.")
+            return
+        await send_long(channel, self.digest(batch))
+        self.relayed += len(batch)
+        self.digests += 1
+        metrics.inc("dm_relay_digests_total")
+
+    def stats(self):
+        return {"relayed": self.relayed, "digests": self.digests, "pending": len(self._pending)}
@@ -0,0 +1,281 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from datetime import timedelta
+import metrics
+from admission import PriorityGate, PRIORITY_SHORT
+from chat_store import to_turn
+from conversation import estimate_tokens
+
+
+def gemini_model(api_key, model_name, system_instruction=None, cache_ttl=0):
+    """GenerativeModel with `system_instruction` (the persona).
+
+    With `cache_ttl` (seconds), the instruction is put in a context cache so it's
+    not sent and billed in full with every request; if the API refuses (the
+    prefix is under the model's minimum cache size, or caching isn't available
+    for the model), the plain system instruction is used. The cache, if any, is
+    kept as `model.context_cache` (see `extend_context_cache`).
+    """
+    import google.generativeai as genai
+    genai.configure(api_key=api_key)
+    if system_instruction and cache_ttl:
+        try:
+            from google.generativeai import caching
+            cache = caching.CachedContent.create(
+                model=model_name, system_instruction=system_instruction, ttl=timedelta(seconds=cache_ttl)
+            )
+            model = genai.GenerativeModel.from_cached_content(cache)
+            model.context_cache = cache
+            logging.info(f"🧠 System instruction served from context cache {cache.name}")
+            return model
+        except Exception as e:
+            logging.warning(f"Context cache not available ({e}), the system instruction is sent with each request")
+    model = genai.GenerativeModel(model_name, system_instruction=system_instruction)
+    model.context_cache = None
+    return model
+
+
+def extend_context_cache(model, ttl):
+    # Called periodically so the cache doesn't expire under running conversations
+    cache = getattr(model, "context_cache", None)
+    if cache is not None:
+        cache.update(ttl=timedelta(seconds=ttl))
+
+
+def request_stats(history, prompt, response, system_bytes=0):
+    """(payload bytes, prompt tokens, cached tokens) of one Gemini request.
+
+    Token counts come from the response's usage metadata when there is one,
+    else they are estimated from the payload. `system_bytes` is the size of a
+    system instruction sent along with the request (0 when it's cached).
+    """
+    payload = system_bytes + len(prompt.encode("utf-8")) + sum(
+        len(json.dumps(to_turn(msg)["parts"], ensure_ascii=False).encode("utf-8")) for msg in history
+    )
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None and getattr(usage, "prompt_token_count", 0):
+        return payload, usage.prompt_token_count, getattr(usage, "cached_content_token_count", 0) or 0
+    return payload, estimate_tokens("x" * payload), 0
+
+
+def record_request(stats):
+    payload, prompt_tokens, cached_tokens = stats
+    metrics.inc("gemini_requests_total")
+    metrics.inc("gemini_payload_bytes_total", payload)
+    metrics.inc("gemini_prompt_tokens_total", prompt_tokens)
+    metrics.inc("gemini_cached_tokens_total", cached_tokens)
+
+
+class SlotLease:
+    """One of the dispatcher's global slots, freed when the last call using it ends.
+
+    The request that acquired the slot holds it; a call that may outlive the
+    request (e.g. an attempt abandoned at its deadline) `hold()`s it too, so the
+    slot only becomes free again once that call is really over.
+    """
+
+    def __init__(self, gate, loop, priority):
+        self.gate = gate
+        self.loop = loop
+        self.priority = priority
+        self._holders = 1
+        self._lock = threading.Lock()
+
+    def hold(self):
+        with self._lock:
+            self._holders += 1
+
+    def release(self):
+        with self._lock:
+            self._holders -= 1
+            free = self._holders == 0
+        if free:
+            self.loop.call_soon_threadsafe(self.gate.release)
+
+
+class GeminiDispatcher:
+    """Run Gemini calls off the event loop.
+
+    Requests from one user are processed in arrival order (one per user at a
+    time), and at most `max_in_flight` Gemini calls run at once for the whole bot.
+    When all slots are busy, waiting requests get the next free one by priority
+    (see admission.PRIORITY_*). `system_bytes()` gives the size of the system
+    instruction sent with each request, for the payload metrics.
+    """
+
+    def __init__(self, get_chat, max_in_flight=4, system_bytes=lambda: 0):
+        self.get_chat = get_chat
+        self.system_bytes = system_bytes
+        self.max_in_flight = max_in_flight
+        self._global = PriorityGate(max_in_flight)
+        # Own pool so Gemini calls never starve (or get starved by) the default executor
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="gemini")
+        self._user_locks = {}
+        self._waiting = {}
+        self._local = threading.local()  # lease of the request an executor thread is serving
+
+    def pending(self, user_id=None):
+        # Number of requests queued or running (for one user or for everybody)
+        if user_id is not None:
+            return self._waiting.get(user_id, 0)
+        return sum(self._waiting.values())
+
+    @asynccontextmanager
+    async def _user_turn(self, user_id):
+        # asyncio.Lock wakes its waiters in FIFO order, so it doubles as a per-user queue
+        lock = self._user_locks.setdefault(user_id, asyncio.Lock())
+        self._waiting[user_id] = self._waiting.get(user_id, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._waiting[user_id] -= 1
+            if not self._waiting[user_id]:
+                # Nobody else waiting for this user, forget the lock
+                del self._waiting[user_id]
+                self._user_locks.pop(user_id, None)
+
+    def queue_depth(self):
+        # Requests waiting for a free Gemini slot
+        return self._global.depth()
+
+    async def _lease(self, priority):
+        await self._global.acquire(priority)
+        return SlotLease(self._global, asyncio.get_running_loop(), priority)
+
+    def current_lease(self):
+        """From a call running in the dispatcher: the slot of the request being served."""
+        return getattr(self._local, "lease", None)
+
+    @contextmanager
+    def extra_slot(self, lease):
+        """From another thread: one more global slot (e.g. for a hedged attempt), waited for like any request."""
+        asyncio.run_coroutine_threadsafe(self._global.acquire(lease.priority), lease.loop).result()
+        try:
+            yield
+        finally:
+            lease.loop.call_soon_threadsafe(self._global.release)
+
+    def _serving(self, lease, func, *args):
+        # Runs in the executor: `func` can find the request's lease with current_lease()
+        self._local.lease = lease
+        try:
+            return func(*args)
+        finally:
+            self._local.lease = None
+
+    async def send(self, user_id, prompt, channel=None, priority=PRIORITY_SHORT):
+        """Send `prompt` on the user's ChatSession and return the response.
+
+        While the request waits or runs, `channel` (if given) shows the typing indicator.
+        """
+        typing = channel.typing() if channel is not None else nullcontext()
+        async with typing:
+            async with self._user_turn(user_id):
+                lease = await self._lease(priority)
+                try:
+                    start = time.perf_counter()
+                    loop = asyncio.get_running_loop()
+                    response = await loop.run_in_executor(self._executor, self._serving, lease, self._send_sync,
+                                                          user_id, prompt)
+                    logging.info(f"Gemini reply for {user_id} in {time.perf_counter() - start:.2f}s")
+                    return response
+                finally:
+                    lease.release()
+
+    async def stream(self, user_id, prompt, priority=PRIORITY_SHORT):
+        """Same as `send`, but yields the reply text chunk by chunk as Gemini streams it."""
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        done = object()
+
+        def produce():
+            try:
+                with metrics.timer("gemini_request_seconds", mode="stream"):
+                    self._stream_sync(user_id, prompt, loop, queue)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+
+        async with self._user_turn(user_id):
+            lease = await self._lease(priority)
+            try:
+                future = loop.run_in_executor(self._executor, self._serving, lease, produce)
+                try:
+                    while (item := await queue.get()) is not done:
+                        if isinstance(item, Exception):
+                            raise item
+                        yield item
+                finally:
+                    await future
+            finally:
+                lease.release()
+
+    async def remember(self, user_id, prompt, reply):
+        """Add an exchange answered without Gemini (e.g. from a cache) to the user's history."""
+        async with self._user_turn(user_id):
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self._executor, self._remember_sync, user_id, prompt, reply)
+
+    def _remember_sync(self, user_id, prompt, reply):
+        chat = self.get_chat(user_id)
+        chat.history = list(chat.history) + [
+            {"role": "user", "parts": [prompt]},
+            {"role": "model", "parts": [reply]},
+        ]
+
+    def _stream_sync(self, user_id, prompt, loop, queue):
+        chat = self.get_chat(user_id)
+        history = list(chat.history)
+        chunk = None
+        for chunk in chat.send_message(prompt, stream=True):
+            try:
+                text = chunk.text
+            except ValueError:
+                continue  # chunk without text (e.g. only safety ratings)
+            loop.call_soon_threadsafe(queue.put_nowait, text)
+        # The last chunk carries the usage of the whole request
+        record_request(request_stats(history, prompt, chunk, self.system_bytes()))
+
+    def _send_sync(self, user_id, prompt):
+        chat = self.get_chat(user_id)
+        history = list(chat.history)
+        with metrics.timer("gemini_request_seconds", mode="send"):
+            response = chat.send_message(prompt)
+        record_request(request_stats(history, prompt, response, self.system_bytes()))
+        return response
+
+
+if __name__ == "__main__":
+    # Local check with a fake model: N concurrent mentions should take about as
+    # long as the slowest one, not the sum of all of them.
+    import random
+
+    class FakeResponse:
+        def __init__(self, text):
+            self.text = text
+
+    class FakeChat:
+        def __init__(self):
+            self.history = []
+
+        def send_message(self, prompt):
+            time.sleep(random.uniform(0.2, 0.5))  # blocking, like the real client
+            return FakeResponse(f"echo: {prompt}")
+
+    chats = {}
+
+    async def demo(n=8):
+        dispatcher = GeminiDispatcher(lambda user_id: chats.setdefault(user_id, FakeChat()), max_in_flight=n)
+        start = time.perf_counter()
+        replies = await asyncio.gather(*(dispatcher.send(i, f"hello {i}") for i in range(n)))
+        elapsed = time.perf_counter() - start
+        print(f"{len(replies)} concurrent mentions answered in {elapsed:.2f}s (sequential would be ~{n * 0.35:.1f}s)")
+
+    asyncio.run(demo())
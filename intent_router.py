@@ -0,0 +1,79 @@
+import re
+import metrics
+
+_EVENTS = r"(check[- ]?in|check[- ]?out|break|lunch)"
+
+# One table for every intent the bot can answer without Gemini: name -> patterns.
+# Patterns are anchored on the phrasing of schedule questions: short coding questions
+# ("time complexity of sort", "current time in python") must still reach Gemini.
+INTENTS = {
+    "next_event": [
+        r"\bnext (check[- ]?in|check[- ]?out|break|lunch|event)\b",
+        rf"\bwhen (is|are|do|does|will) .{{0,20}}{_EVENTS}",
+        rf"\bwhat time (is|are|do|does|will) .{{0,20}}{_EVENTS}",
+        rf"\bhow long (until|till) (the )?(next )?{_EVENTS}",
+    ],
+    "time": [r"\bwhat time is it\b", r"\bwhat'?s the time\b(?!\s+complexity)",
+             r"\bwhat is the time\b(?!\s+complexity)", r"\bquelle heure\b"],
+    "moodle": [r"\bmoodle\b", r"\bcheck[- ]?in link\b"],
+    "techtalk": [r"\btech[- ]?talks?\b"],
+}
+
+_MENTION = re.compile(r"<@[!&]?\d+>")
+
+
+class IntentRouter:
+    """Finds the local intents of a message with a single compiled regex.
+
+    Every pattern of the table becomes an alternative of one named group per
+    intent, so a message is scanned once whatever the number of patterns.
+    Short messages whose intents are all known are answered locally; longer
+    (open-ended) ones still go to Gemini.
+    """
+
+    def __init__(self, intents=INTENTS, max_local_words=12):
+        self.max_local_words = max_local_words
+        self._pattern = re.compile(
+            "|".join(f"(?P<{name}>{'|'.join(patterns)})" for name, patterns in intents.items()),
+            re.IGNORECASE,
+        )
+        self.routed_local = 0
+        self.routed_llm = 0
+
+    def intents(self, text):
+        return {match.lastgroup for match in self._pattern.finditer(text)}
+
+    def needs_llm(self, text, intents):
+        # No known intent, or a longer question that the templates can't fully answer
+        words = len(_MENTION.sub("", text).split())
+        if intents and words <= self.max_local_words:
+            self.routed_local += 1
+            metrics.inc("llm_calls_avoided_total")
+            return False
+        self.routed_llm += 1
+        return True
+
+    def stats(self):
+        return {"llm_calls_avoided": self.routed_local, "llm_calls": self.routed_llm}
+
+
+if __name__ == "__main__":
+    # Local check: schedule questions are routed locally, look-alike coding questions are not
+    router = IntentRouter()
+    local = {
+        "what time is it?": {"time"},
+        "What's the time": {"time"},
+        "quelle heure est-il": {"time"},
+        "when is the next check-in?": {"next_event"},
+        "how long until lunch": {"next_event"},
+        "what time does the break start": {"next_event"},
+        "where is the moodle link?": {"moodle"},
+        "what's today's tech talk?": {"techtalk"},
+    }
+    for text, expected in local.items():
+        assert router.intents(text) == expected, (text, router.intents(text))
+    for text in ["what's the time complexity of sort", "how do I get the current time in python",
+                 "how long before my model converges", "compute the attendance rate with pandas",
+                 "what time zone does datetime.now() use"]:
+        assert not router.intents(text), (text, router.intents(text))
+    print(f"{len(local)} schedule questions routed locally, look-alike coding questions sent to Gemini")
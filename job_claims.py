@@ -0,0 +1,50 @@
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+
+class JobClaims:
+    """Makes sure each scheduled post goes out once, however many bot processes run.
+
+    Before sending, a process claims the (job, slot) pair, e.g.
+    ("broadcast:<channel id>", "2025-05-26 08:55"), in a SQLite file shared by
+    all the processes of the host. The first claim wins; the others skip.
+    """
+
+    def __init__(self, path, owner=None):
+        self.path = path
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_runs ("
+                " job TEXT NOT NULL, slot TEXT NOT NULL, owner TEXT NOT NULL, claimed_at REAL NOT NULL,"
+                " PRIMARY KEY (job, slot))"
+            )
+        self.won = 0
+        self.lost = 0
+
+    def claim(self, job, slot):
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO job_runs VALUES (?, ?, ?, ?)", (job, slot, self.owner, time.time())
+            )
+        if cursor.rowcount:
+            self.won += 1
+            return True
+        self.lost += 1
+        logging.info(f"⏭️ {job} at {slot} already done by another process")
+        return False
+
+    def prune(self, keep_days=7):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM job_runs WHERE claimed_at < ?", (time.time() - keep_days * 86400,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,44 +1,133 @@
+import startup  # first, so STARTUP_PROFILE=1 can time the other imports
 import os
 from dotenv import load_dotenv
 import discord
-from discord.ext import tasks, commands
+from discord.ext import commands
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 import logging
 from datetime import datetime, timedelta
-import pytz  # for timezone
-import google.generativeai as genai
-from sheets_utils import get_techtalk_message_if_today
-import json
+from sheets_utils import TechTalkCache, get_sheets_client
+from techtalk_index import TechTalkIndex
+from gemini_dispatch import GeminiDispatcher, gemini_model, extend_context_cache
+from worker_pool import GeminiWorkerPool, ProcessGeminiDispatcher
+from job_claims import JobClaims
+from answer_cache import AnswerCache, conversation_key
+from blocking_detector import BlockingDetector
+from resilience import CircuitBreaker, ResilientChat
+from intent_router import IntentRouter
+from admission import (AdmissionController, ADMITTED, DUPLICATE, THROTTLED_USER, THROTTLED_GLOBAL,
+                       PRIORITY_DM, PRIORITY_SHORT, PRIORITY_LONG)
+from chat_store import open_chat_store, migrate_json, to_turn
+from conversation import ConversationManager
+from checkpoint import CheckpointService
+from replies import send, reply, send_long, stream_reply, split_message, StreamInterrupted
+from schedule import Schedule
+from broadcast import Broadcaster
+from dm_relay import DMRelay
+from anniversaries import Anniversaries
+import metrics
+from discord import app_commands
 import signal
 import asyncio
+import functools
+import threading
 
 # Load environment variables from .env file
 load_dotenv()
 TOKEN = os.getenv("DISCORD_TOKEN")
-CHANNEL_ID_AI = int(os.getenv("CHANNEL_ID_AI"))
-CHANNEL_ID_WEBDEV = int(os.getenv("CHANNEL_ID_WEBDEV"))
 CHANNEL_TEST_ID = int(os.getenv("CHANNEL_TEST_ID"))
 GEMINI_API=os.getenv("GEMINI_API")
+GEMINI_MODEL = "gemini-2.0-flash"
+GEMINI_MAX_IN_FLIGHT = int(os.getenv("GEMINI_MAX_IN_FLIGHT", "4"))
+GEMINI_WORKERS = int(os.getenv("GEMINI_WORKERS", "0"))  # >0 runs the Gemini calls in that many worker processes
+GEMINI_CONTEXT_CACHE_TTL = int(os.getenv("GEMINI_CONTEXT_CACHE_TTL", "0"))  # >0 puts the persona in a context cache
+GEMINI_DEADLINE = float(os.getenv("GEMINI_DEADLINE", "30"))  # seconds without any reply before giving up
+GEMINI_HEDGE_AFTER = float(os.getenv("GEMINI_HEDGE_AFTER", "8"))  # seconds before asking the fallback model too, 0 disables
+GEMINI_REQUEST_TIMEOUT = float(os.getenv("GEMINI_REQUEST_TIMEOUT", "60"))  # seconds before an abandoned attempt is cut off
+GEMINI_FALLBACK_MODEL = os.getenv("GEMINI_FALLBACK_MODEL", "gemini-2.0-flash-lite")  # empty disables hedging
+GEMINI_BREAKER_FAILURES = int(os.getenv("GEMINI_BREAKER_FAILURES", "5"))  # failures in a row that open the circuit
+GEMINI_BREAKER_RESET = float(os.getenv("GEMINI_BREAKER_RESET", "30"))  # seconds before trying Gemini again
+GEMINI_USER_RPM = float(os.getenv("GEMINI_USER_RPM", "6"))
+GEMINI_USER_BURST = int(os.getenv("GEMINI_USER_BURST", "3"))
+GEMINI_GLOBAL_RPM = float(os.getenv("GEMINI_GLOBAL_RPM", "60"))
+GEMINI_GLOBAL_BURST = int(os.getenv("GEMINI_GLOBAL_BURST", "15"))
+STREAM_REPLIES = os.getenv("STREAM_REPLIES", "1") == "1"
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "500"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_FUZZY = float(os.getenv("ANSWER_CACHE_FUZZY", "0"))  # e.g. 0.95 also matches near-identical questions
+ANSWER_CACHE_FALLBACK_FUZZY = float(os.getenv("ANSWER_CACHE_FALLBACK_FUZZY", "0"))  # same, while Gemini is down
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # 0 disables the Prometheus endpoint
+BLOCKING_THRESHOLD = float(os.getenv("BLOCKING_THRESHOLD", "0"))  # >0 reports callbacks blocking the loop that long (dev)
 CHAT_HISTORY_FILE = "user_chats.json"
+SHARDED = os.getenv("SHARDED", "0") == "1"  # AutoShardedBot, for many guilds
+SHARD_COUNT = os.getenv("SHARD_COUNT")  # with SHARD_IDS, to split the shards between several processes
+SHARD_IDS = os.getenv("SHARD_IDS")  # e.g. "0,1"
+JOB_CLAIMS_PATH = os.getenv("JOB_CLAIMS_PATH", "jobs.db")  # shared by the bot processes of the host
+SCHEDULE_FILE = os.getenv("SCHEDULE_FILE", "schedule.json")
+COHORTS_FILE = os.getenv("COHORTS_FILE", "cohorts.json")
+ANNIVERSARIES_FILE = os.getenv("ANNIVERSARIES_FILE", "anniversaries.json")
+ANNIVERSARIES_SHEET_URL = os.getenv("ANNIVERSARIES_SHEET_URL")  # optional sheet with user_id, date, kind columns
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "10"))
+CHAT_STORE_PATH = os.getenv("CHAT_STORE_PATH", "user_chats.db")
+CHECKPOINT_INTERVAL = int(os.getenv("CHECKPOINT_INTERVAL", "60"))
+SHUTDOWN_FLUSH_TIMEOUT = float(os.getenv("SHUTDOWN_FLUSH_TIMEOUT", "10"))
+CHAT_MAX_SESSIONS = int(os.getenv("CHAT_MAX_SESSIONS", "200"))
+CHAT_IDLE_TTL = int(os.getenv("CHAT_IDLE_TTL", str(6 * 3600)))
+CHAT_MAX_TOTAL_TOKENS = int(os.getenv("CHAT_MAX_TOTAL_TOKENS", "2000000"))
+CHAT_TOKEN_BUDGET = int(os.getenv("CHAT_TOKEN_BUDGET", "8000"))
 Ali=os.getenv("Ali")
 Robin=os.getenv("Robin")
 Elsa=os.getenv("Elsa")
 Mehdi=os.getenv("Mehdi")
+DM_RELAY_WINDOW = float(os.getenv("DM_RELAY_WINDOW", "5"))  # seconds of DMs per staff digest
+DM_RELAY_PINGS = os.getenv("DM_RELAY_PINGS", ",".join(filter(None, (Mehdi, Robin, Elsa)))).split(",")  # user IDs pinged in digests
+DM_RELAY_PING_POLICY = os.getenv("DM_RELAY_PING_POLICY", "every")  # every, cooldown or none
+DM_RELAY_PING_COOLDOWN = int(os.getenv("DM_RELAY_PING_COOLDOWN", "600"))
 json_keyfile_path = "discordbot.json"
 sheet_url = "https://docs.google.com/spreadsheets/d/1FLktNFlFQCHLaEnw_o_0UJDcXnpYxg2ynoZeq_b-iBQ/edit?gid=0#gid=0"
-#configure gemini
-genai.configure(api_key=GEMINI_API)  # Ton token API
-model = genai.GenerativeModel("gemini-2.0-flash")
-
-user_chats = {}
+TECHTALK_CACHE_TTL = int(os.getenv("TECHTALK_CACHE_TTL", "3600"))
+TECHTALK_INDEX_PATH = os.getenv("TECHTALK_INDEX_PATH", "techtalks.db")
+TECHTALK_SYNC_INTERVAL = int(os.getenv("TECHTALK_SYNC_INTERVAL", "15"))  # minutes between sheet revision checks
+TECHTALK_REFRESH_LEAD = int(os.getenv("TECHTALK_REFRESH_LEAD", "5"))  # minutes before the tech talk post to warm its cache
+LAZY_INIT = os.getenv("LAZY_INIT", "1") == "1"  # 0 builds the Gemini and Sheets clients before connecting
+
+# Gemini model, created on the first question (google.generativeai alone takes a second to import)
+model = None
+model_lock = threading.Lock()
+
+def get_model():
+    global model
+    with model_lock:
+        if model is None:
+            with startup.phase("gemini model"):
+                model = gemini_model(GEMINI_API, GEMINI_MODEL, system_instruction=PERSONA,
+                                     cache_ttl=GEMINI_CONTEXT_CACHE_TTL)
+        return model
+
+# Smaller model asked in parallel when the main one is slow to answer
+fallback_model = None
+
+def get_fallback_model():
+    global fallback_model
+    with model_lock:
+        if fallback_model is None:
+            fallback_model = gemini_model(GEMINI_API, GEMINI_FALLBACK_MODEL, system_instruction=PERSONA)
+        return fallback_model
+
+def system_bytes():
+    # Size of the persona sent with each request (nothing when it's in a context cache)
+    return 0 if getattr(model, "context_cache", None) else len(PERSONA.encode("utf-8"))
+
+async def extend_persona_cache():
+    if model is not None:
+        try:
+            await asyncio.to_thread(extend_context_cache, model, GEMINI_CONTEXT_CACHE_TTL)
+        except Exception as e:
+            logging.error(f"❌ Could not extend the context cache: {e}")
 
-def get_chat_for_user(user_id):
-    if user_id not in user_chats:
-        user_chats[user_id] = model.start_chat(history=[
-            {
-                "role": "user",
-                "parts": [
-                    """
+# System instruction of the model (not part of the conversations)
+PERSONA = """
 You are a smart and witty Discord bot assistant designed for Becode learners.
 Your mission is to support users with:
 	1.	Check-ins and check-outs on the Moodle platform:
@@ -60,52 +149,125 @@ Always aim to:
 	•	Summarize or skip less crucial details when needed
     •   If someone is late to checkin or checkout, he should be punish by Antoine or Nicoach and bring croissants
 """
-                ]
-            }
-        ])
-    return user_chats[user_id]
-
-
-# Assuming you already have a 'model' object and user_chats dictionary
-def save_user_chats(filepath=CHAT_HISTORY_FILE):
-    serializable = {}
-    for user_id, chat in user_chats.items():
-        serializable[user_id] = []
-        for msg in chat.history:
-            print(type(msg))         # Affiche le type de l'objet
-            print(dir(msg))          # Affiche les méthodes et attributs de l'objet
-            print(vars(msg))   
-
-            # Extraire les données texte depuis `msg.parts`
-            parts_data = []
-            if hasattr(msg, 'parts'):
-                if isinstance(msg.parts, list):
-                    parts_data = [str(part) for part in msg.parts]
-                elif isinstance(msg.parts, dict):
-                    # Dans le cas peu probable où `parts` est un dict avec une clé 'text'
-                    if 'text' in msg.parts:
-                        parts_data = [str(msg.parts['text'])]
-                else:
-                    # Fallback pour types inattendus
-                    parts_data = [str(msg.parts)]
-
-            serializable[user_id].append({
-                "role": msg.role,
-                "parts": parts_data
-            })
-
-    with open(filepath, 'w') as f:
-        json.dump(serializable, f, indent=2)
-    print("✅ User chats saved")
+
+# Number of history turns already written to the chat store, per user
+saved_turns = {}
+persist_lock = threading.Lock()
+with startup.phase("chat store"):
+    chat_store = open_chat_store(CHAT_STORE_PATH)
+
+def load_chat(user_id):
+    # History is only read from the store the first time a user shows up
+    history = chat_store.load(user_id)
+    saved_turns[user_id] = len(history)
+    return get_model().start_chat(history=history)
+
+def save_user_chat(user_id, chat):
+    # Only the turns added since the last save are written (checkpoints, evictions
+    # and trims can run from different threads, hence the lock)
+    with persist_lock:
+        history = chat.history
+        new_turns = [to_turn(msg) for msg in history[saved_turns.get(user_id, 0):]]
+        written = chat_store.append(user_id, new_turns)
+        saved_turns[user_id] = len(history)
+        return written
+
+# Sessions are kept in memory with LRU/idle eviction and a token budget per history
+conversations = ConversationManager(
+    load_chat,
+    on_evict=save_user_chat,
+    max_sessions=CHAT_MAX_SESSIONS,
+    idle_ttl=CHAT_IDLE_TTL,
+    max_total_tokens=CHAT_MAX_TOTAL_TOKENS,
+    token_budget=CHAT_TOKEN_BUDGET,
+    is_busy=lambda user_id: gemini.pending(user_id) > 0,
+)
+user_chats = conversations.sessions
+
+def get_chat_for_user(user_id):
+    chat = conversations.get(user_id)
+    if conversations.needs_trim(chat):
+        save_user_chat(user_id, chat)  # never drop turns that aren't stored yet
+        conversations.trim(user_id, chat)
+        saved_turns[user_id] = len(chat.history)
+    # Deadline and hedging per request; the session itself stays in `conversations`
+    return ResilientChat(
+        chat,
+        deadline=GEMINI_DEADLINE,
+        hedge_after=GEMINI_HEDGE_AFTER or None,
+        fallback_model=get_fallback_model if GEMINI_FALLBACK_MODEL else None,
+        timeout=GEMINI_REQUEST_TIMEOUT,
+        slots=gemini,  # hedges and abandoned attempts count against GEMINI_MAX_IN_FLIGHT
+    )
+
+# Gemini calls run in worker threads (or processes), ordered per user and capped globally
+if GEMINI_WORKERS:
+    # The workers read and write the histories in the chat store themselves
+    gemini_workers = GeminiWorkerPool(
+        GEMINI_WORKERS,
+        CHAT_STORE_PATH,
+        functools.partial(gemini_model, GEMINI_API, GEMINI_MODEL, system_instruction=PERSONA),
+        token_budget=CHAT_TOKEN_BUDGET,
+    )
+    gemini = ProcessGeminiDispatcher(gemini_workers, max_in_flight=GEMINI_MAX_IN_FLIGHT,
+                                     system_bytes=lambda: len(PERSONA.encode("utf-8")), deadline=GEMINI_DEADLINE)
+else:
+    gemini_workers = None
+    gemini = GeminiDispatcher(get_chat_for_user, max_in_flight=GEMINI_MAX_IN_FLIGHT, system_bytes=system_bytes)
+# While Gemini keeps failing, questions are answered right away without it
+breaker = CircuitBreaker(failure_threshold=GEMINI_BREAKER_FAILURES, reset_timeout=GEMINI_BREAKER_RESET)
+# Per-user and global rate limits in front of Gemini
+admission = AdmissionController(
+    user_rpm=GEMINI_USER_RPM,
+    user_burst=GEMINI_USER_BURST,
+    global_rpm=GEMINI_GLOBAL_RPM,
+    global_burst=GEMINI_GLOBAL_BURST,
+)
+# Mentions about time, schedule, Moodle or tech talks are answered without Gemini
+router = IntentRouter()
+answer_cache = AnswerCache(
+    max_size=ANSWER_CACHE_SIZE,
+    ttl=ANSWER_CACHE_TTL,
+    fuzzy_threshold=ANSWER_CACHE_FUZZY or None,
+)
+
+def checkpoint_user(user_id):
+    chat = conversations.sessions.get(user_id)
+    return save_user_chat(user_id, chat) if chat is not None else 0
+
+# Chats that changed are saved every CHECKPOINT_INTERVAL seconds, off the event loop
+checkpoints = CheckpointService(
+    checkpoint_user,
+    is_busy=lambda user_id: gemini.pending(user_id) > 0,
+    interval=CHECKPOINT_INTERVAL,
+)
+
+def save_user_chats():
+    written = 0
+    for user_id, chat in conversations.items():
+        written += save_user_chat(user_id, chat)
+    logging.info(f"✅ User chats saved ({written} bytes)")
 
 def load_user_chats(filepath=CHAT_HISTORY_FILE):
-    if not os.path.exists(filepath):
-        return
-    with open(filepath, 'r') as f:
-        data = json.load(f)
-        for user_id, history in data.items():
-            user_chats[user_id] = model.start_chat(history=history)
-    print("📥 User chats loaded")
+    # One-shot import of the legacy JSON dump; histories themselves are loaded lazily
+    if os.path.exists(filepath) and chat_store.is_empty():
+        migrate_json(filepath, chat_store)
+        print("📥 User chats migrated")
+    # The persona used to be stored as the first turn of every history (cleaned up once per store)
+    if not chat_store.migrated("persona"):
+        dropped = chat_store.drop_first_turn(to_turn({"role": "user", "parts": [PERSONA]}))
+        chat_store.mark_migrated("persona")
+        if dropped:
+            print(f"🧹 Persona removed from {dropped} stored histories")
+    record_store_size()
+
+def record_store_size():
+    if os.path.exists(CHAT_STORE_PATH):
+        metrics.set_gauge("chat_store_bytes", os.path.getsize(CHAT_STORE_PATH))
+
+async def checkpoint_chats():
+    await checkpoints.checkpoint()
+    record_store_size()
 
 # Function to shutdown gracefully
 async def shutdown_bot():
@@ -115,7 +277,10 @@ async def shutdown_bot():
 # Handling exit signals
 async def handle_exit_signal(*args):
     print("🔻 Shutdown signal received")
-    save_user_chats()
+    await checkpoints.flush(timeout=SHUTDOWN_FLUSH_TIMEOUT)
+    await dm_relay.flush()
+    if BLOCKING_THRESHOLD:
+        logging.info(blocking_detector.report())
     await shutdown_bot()  # Await directly here
 
 # Configure logging
@@ -124,140 +289,179 @@ logging.basicConfig(level=logging.INFO)
 # Create intents and the bot
 intents = discord.Intents.default()
 intents.messages = True  # Ensure that the messages intent is enabled
-bot = commands.Bot(command_prefix="!", intents=intents)
+if SHARDED:
+    bot = commands.AutoShardedBot(
+        command_prefix="!",
+        intents=intents,
+        shard_count=int(SHARD_COUNT) if SHARD_COUNT else None,
+        shard_ids=[int(shard_id) for shard_id in SHARD_IDS.split(",")] if SHARD_IDS else None,
+    )
+else:
+    bot = commands.Bot(command_prefix="!", intents=intents)
+# Scheduled posts are claimed here first, so that they're sent once even with several processes
+job_claims = JobClaims(JOB_CLAIMS_PATH)
 scheduler = AsyncIOScheduler(timezone='Europe/Brussels')  # Change as needed
 
-# List of check-in and check-out times
-checkin_times = ["08:55", "13:25"]
-checkout_times = ["12:30", "17:00"]
-techtalk_time = "13:25"
-break_time = ["11:00", "15:00"]
-lunch_time = ["12:30"]
-
-# List of birthdays (user ID and birthday date)
-birthdays = {
-    Ali: "2025-05-25",
-    Mehdi: "2025-10-21"
+# Check-in, check-out, break, lunch and tech talk times (see schedule.json)
+schedule = Schedule(SCHEDULE_FILE)
+
+# Scheduled message per event kind, the first matching kind of a slot wins
+message_templates = {
+    "CHECK-IN": "🤖 {role} bip boup bip boup CHECK-IN 🤖 \nMoodle link : {link}",
+    "CHECK-OUT": "🤖 {role} bip boup bip boup CHECK-OUT 🤖 \nMoodle link : {link}",
+    "BREAKTIME": "🤖 {role} bip boup bip boup BREAK-TIME ☕️☕️ 🤖",
 }
+lunch_template = "\n 🤖 It's LUNCH-TIME 🌯 🤖"
+
+def message_template_for(kinds):
+    for kind, template in message_templates.items():
+        if kind in kinds:
+            if kind == "CHECK-IN" and "LUNCHTIME" in kinds:
+                template += lunch_template
+            return template
+    return ""
+
+# Cohort channels that get the scheduled messages (see cohorts.json)
+broadcaster = Broadcaster(bot, COHORTS_FILE, max_concurrency=BROADCAST_CONCURRENCY)
+
+# Tech talk of the day, served from memory and refreshed in the background
+# (the sheet is mirrored in a local SQLite index, re-downloaded only when it changes)
+techtalk_index = TechTalkIndex(TECHTALK_INDEX_PATH)
+techtalk_cache = TechTalkCache(json_keyfile_path, sheet_url, techtalk_index, ttl=TECHTALK_CACHE_TTL)
+
+async def todays_techtalk():
+    # "" when the sheet can't be read: the rest of the reply doesn't depend on it
+    try:
+        return await techtalk_cache.get()
+    except Exception as e:
+        logging.error(f"❌ Could not load today's tech talk: {e}")
+        return ""
+
+# DMs are forwarded to the staff channel in digests of DM_RELAY_WINDOW seconds
+dm_relay = DMRelay(
+    lambda: bot.get_channel(CHANNEL_TEST_ID),
+    window=DM_RELAY_WINDOW,
+    pings=DM_RELAY_PINGS,
+    ping_policy=DM_RELAY_PING_POLICY,
+    ping_cooldown=DM_RELAY_PING_COOLDOWN,
+)
+
+# Birthdays and other yearly events (see anniversaries.json), wished by DM every day at their send_time
+anniversaries = Anniversaries(
+    bot,
+    ANNIVERSARIES_FILE,
+    now=schedule.now,
+    max_concurrency=BROADCAST_CONCURRENCY,
+    claim=lambda user_id, day: job_claims.claim(f"anniversary:{user_id}", str(day)),
+)
+
+async def refresh_anniversaries_sheet():
+    if not ANNIVERSARIES_SHEET_URL:
+        return
+    try:
+        sheet = await asyncio.to_thread(get_sheets_client(json_keyfile_path).worksheet, ANNIVERSARIES_SHEET_URL)
+        anniversaries.set_records(await asyncio.to_thread(sheet.get_all_records))
+    except Exception as e:
+        logging.error(f"❌ Could not load the anniversaries sheet: {e}")
 
+@metrics.timed("scheduled_job_seconds", job="scheduled_message")
 async def send_scheduled_message(time_str):
 
-    if datetime.now(pytz.timezone('Europe/Brussels')).weekday() >= 5:
-        logging.info("😴 Week-end detected, no message sent.")
+    kinds = schedule.kinds_at(schedule.now().date(), time_str)
+    if not kinds:
+        logging.info("😴 Day off, no message sent.")
         return
 
     logging.info(f"Trying to send scheduled message at {time_str}")
-    
-    channels_config = {
-        #CHANNEL_ID_WEBDEV: {"role_name": "Hamilton 10", "moodle_link": "https://moodle.becode.org/mod/attendance/view.php?id=1217"},
-        CHANNEL_ID_AI: {"role_name": "Thomas5", "moodle_link": "https://moodle.becode.org/mod/attendance/view.php?id=1433"}
-    }
-
-    channels_test_config = {
-        CHANNEL_TEST_ID: {"role_name": "prout", "moodle_link": "https://mehdi-godefroid.com" }
-    }
-    
-    # Message config
-    message_template = ""
-    if time_str in checkin_times:
-        message_template = "🤖 {role} bip boup bip boup CHECK-IN 🤖 \nMoodle link : {link}"
-
-        if time_str in lunch_time:
-            message_template += "\n 🤖 It's LUNCH-TIME 🌯 🤖"
-
-    elif time_str in checkout_times:
-        message_template = "🤖 {role} bip boup bip boup CHECK-OUT 🤖 \nMoodle link : {link}"
-
-    elif time_str in break_time:
-        message_template = "🤖 {role} bip boup bip boup BREAK-TIME ☕️☕️ 🤖"
-        
-    #else:
-        #message_template = "🤖 {role} It's working! 🤖"
-    
-    # Config channel
-    for channel_id, config in channels_config.items():
-        try:
-            channel = bot.get_channel(channel_id)
-            if not channel:
-                logging.error(f"❌ Channel with ID {channel_id} not found.")
-                continue
-                
-            # get rOle
-            role = discord.utils.get(channel.guild.roles, name=config["role_name"]) if channel.guild else None
-            role_mention = role.mention if role else ""
-            if not role:
-                logging.warning(f"Role not found in {channel.name}")
-            
-            # Format
-            message = message_template.format(role=role_mention, link=config["moodle_link"])
-            if message:
-                logging.info("message empty")
-            else:
-                message = ""
-            if channel_id == CHANNEL_ID_AI and time_str in techtalk_time:
-                 techTalkMessage = get_techtalk_message_if_today(json_keyfile_path, sheet_url)
-                 logging.info(techTalkMessage)
-                 message += techTalkMessage
-            await channel.send(message)
-            logging.info(f"✅ Message sent to {channel.name} ({channel.id})")
-            
-        except Exception as e:
-            logging.error(f"❌ Error sending message to channel {channel_id}: {e}")
 
-# Function to check birthdays and send messages
-@tasks.loop(hours=24)
-async def check_birthday():
-    current_time = datetime.now(pytz.timezone('Europe/Brussels'))
-    current_date = current_time.strftime("%Y-%m-%d")
-    
-    # Loop through birthdays and check if today is the day
-    for user_id, birthday in birthdays.items():
-        if current_date == birthday:
-            user = await bot.fetch_user(user_id)
-            await user.send(f"🎉 Happy Birthday {user.name}! 🎂")
-            logging.info(f"Sent birthday wish to {user.name}!")
+    # Message config
+    message_template = message_template_for(kinds)
+
+    # Shared data is fetched once per tick, not once per channel
+    # (without the sheet, the cohorts still get their check-in, without the tech talk)
+    techTalkMessage = ""
+    if "TECHTALK" in kinds and broadcaster.wants_techtalk():
+        techTalkMessage = await todays_techtalk()
+        logging.info(techTalkMessage)
+
+    slot = f"{schedule.now().date()} {time_str}"
+    await broadcaster.broadcast(
+        message_template,
+        techtalk=techTalkMessage,
+        claim=lambda channel_id: job_claims.claim(f"broadcast:{channel_id}", slot),
+    )
 
 # Slash command /time to display the current time
 @bot.tree.command(name="time", description="Displays the current time")
 async def time(interaction: discord.Interaction):
-    current_time = datetime.now(pytz.timezone('Europe/Brussels')).strftime("%H:%M:%S")
+    current_time = schedule.now().strftime("%H:%M:%S")
     await interaction.response.send_message(f"The current time is {current_time}.")
 
+# Slash command /stats (admins only) to display latency histograms and counters
+@bot.tree.command(name="stats", description="Displays the bot's performance metrics")
+@app_commands.default_permissions(administrator=True)
+async def stats(interaction: discord.Interaction):
+    permissions = getattr(interaction.user, "guild_permissions", None)
+    if permissions is None or not permissions.administrator:
+        await interaction.response.send_message("⛔ Admins only.", ephemeral=True)
+        return
+    cache = answer_cache.stats()
+    # Short lines first: the metrics summary is the part that gets cut past Discord's limit
+    report = (
+        f"chat_sessions: {len(conversations.sessions)} (evicted {conversations.evictions})\n"
+        f"{conversations.summary()}\n"
+        f"gemini_pending: {gemini.pending()} (waiting for a slot: {gemini.queue_depth()})\n"
+        f"admission: {admission.counts}\n"
+        f"intent_router: {router.routed_local} answered locally / {router.routed_llm} sent to Gemini\n"
+        f"answer_cache: {cache['hits']} hits / {cache['misses']} misses ({cache['size']} entries)\n"
+        f"dm_relay: {dm_relay.relayed} DMs in {dm_relay.digests} digests\n"
+        f"gemini_circuit: {breaker.state} ({breaker.failures} failures in a row)\n"
+        f"{metrics.summary()}"
+    )
+    await interaction.response.send_message(f"```\n{report[:1900]}\n```", ephemeral=True)
+
+# /techtalks week and /techtalks learner, answered from the local copy of the sheet
+techtalks = app_commands.Group(name="techtalks", description="Tech talks from the planning sheet")
+
+def format_techtalk_list(talks):
+    return "\n".join(
+        f"📅 {talk['date'].strftime('%a %d/%m/%y') if talk['date'] else '?'} · {talk['learner']} · {talk['theme']}"
+        for talk in talks
+    )
+
+async def send_techtalk_list(interaction, title, talks):
+    chunks = split_message(f"{title}\n{format_techtalk_list(talks)}" if talks else f"{title}\nNo tech talks found.")
+    await interaction.response.send_message(chunks[0])
+    for chunk in chunks[1:]:
+        await interaction.followup.send(chunk)
+
+@techtalks.command(name="week", description="This week's tech talks")
+async def techtalks_week(interaction: discord.Interaction):
+    today = schedule.now().date()
+    monday = today - timedelta(days=today.weekday())
+    talks = techtalk_index.between(monday, monday + timedelta(days=6))
+    await send_techtalk_list(interaction, f"🎤 Tech talks of the week of {monday.strftime('%d/%m')}", talks)
+
+@techtalks.command(name="learner", description="Tech talks given by a learner")
+@app_commands.describe(name="The learner's name, or part of it")
+async def techtalks_learner(interaction: discord.Interaction, name: str):
+    talks = techtalk_index.by_learner(name)
+    await send_techtalk_list(interaction, f"🎤 Tech talks of {name}", talks)
+
+bot.tree.add_command(techtalks)
+
 # Function to calculate the time remaining until the next check-in or check-out
 def time_until_next_event():
-    current_time = datetime.now(pytz.timezone('Europe/Brussels'))
+    current_time = schedule.now()
+    next_event = schedule.next_event(current_time)
 
-    # List of events with their types
-    all_times = [(time_str, "CHECK-IN") for time_str in checkin_times] + \
-                [(time_str, "CHECK-OUT") for time_str in checkout_times] + \
-                [(time_str, "BREAKTIME") for time_str in break_time] + \
-                [(time_str, "LUNCHTIME") for time_str in lunch_time]
-
-    events = []
-
-    # Convert event times to datetime objects
-    for event_time_str, event_type in all_times:
-        event_hour, event_minute = map(int, event_time_str.split(":"))
-        event_time_obj = current_time.replace(hour=event_hour, minute=event_minute, second=0, microsecond=0)
-        events.append((event_time_obj, event_type))
-
-    # Sort events by ascending time
-    events.sort()
-
-    # Find the next event
-    next_event_time, event_type = None, None
-    for event_time_obj, event_type in events:
-        if current_time < event_time_obj:
-            next_event_time = event_time_obj
-            break
-
-    if next_event_time is None:
+    if next_event is None:
         return "🤖 END OF THE DAY! 🍻"
 
     # Calculate the remaining time until the event
-    time_remaining = next_event_time - current_time
-    hours_remaining = time_remaining.seconds // 3600
-    minutes_remaining = (time_remaining.seconds // 60) % 60
+    seconds_remaining, event_type = next_event
+    hours_remaining = seconds_remaining // 3600
+    minutes_remaining = (seconds_remaining // 60) % 60
 
     # If the current time is before 9am, special message
     if current_time.hour < 9:
@@ -270,7 +474,108 @@ def time_until_next_event():
     # Return the message with the next event
     return f"🤖 Next {event_type} in {hours_remaining}h {minutes_remaining}min"
 
+def register_schedule_jobs():
+    # The posts, and the tech talk cache warmed up TECHTALK_REFRESH_LEAD minutes before its slot
+    schedule.register_jobs(scheduler, send_scheduled_message)
+    schedule.register_before(scheduler, techtalk_cache.refresh, "TECHTALK", TECHTALK_REFRESH_LEAD, "techtalk_refresh")
+
+# Pick up edits of schedule.json without restarting the bot
+def reload_schedule():
+    schedule_changed = schedule.reload_if_changed()
+    if schedule_changed:
+        register_schedule_jobs()
+    # The wishes go out in the schedule's timezone, which may have changed too
+    if anniversaries.reload_if_changed() or schedule_changed:
+        anniversaries.register_job(scheduler, timezone=schedule.timezone)
+
+
+# DMs first, then short questions, then long ones
+def request_priority(message):
+    if isinstance(message.channel, discord.DMChannel):
+        return PRIORITY_DM
+    return PRIORITY_SHORT if len(message.content.split()) <= 25 else PRIORITY_LONG
+
+backpressure_messages = {
+    THROTTLED_USER: "🤖 Easy {user}, one question at a time! Give me a few seconds and ask again ⏳",
+    THROTTLED_GLOBAL: "🤖 {user} I'm answering a lot of learners right now, try again in a minute please ⏳",
+}
 
+# Answer without Gemini when it's down or too slow: the cached answer, else the schedule.
+# After a failed stream, the answer takes the place of the placeholder.
+async def reply_without_gemini(message, context_version, interrupted=None):
+    metrics.inc("gemini_fallback_answers_total")
+    answer = answer_cache.get(message.content, context_version, fuzzy_threshold=ANSWER_CACHE_FALLBACK_FUZZY)
+    if answer is None:
+        answer = (f"🤖 {message.author.mention} my brain (Gemini) isn't answering right now, "
+                  f"ask me again in a few minutes please!\n{time_until_next_event()}")
+    if interrupted is not None:
+        await interrupted.finish(answer)
+    else:
+        await send_long(message.channel, answer)
+
+# Answer with Gemini, streamed into the channel or sent once complete.
+# Repeated questions are answered from the cache (still recorded in the user's history).
+def last_exchange(user_id):
+    # In worker mode the histories are only in the store
+    if gemini_workers:
+        return chat_store.load(user_id)[-2:]
+    return list(get_chat_for_user(user_id).history)[-2:]
+
+async def reply_with_gemini(message, prompt, context_version=""):
+    # Gemini's answer depends on the conversation so far, so it's part of the cache key
+    history_key = conversation_key(await asyncio.to_thread(last_exchange, message.author.id))
+    context_version = f"{schedule.now().date()}|{history_key}|{context_version}"
+    cached = answer_cache.get(message.content, context_version)
+    if cached is not None:
+        await send_long(message.channel, cached)
+        await gemini.remember(message.author.id, prompt, cached)
+        checkpoints.mark_dirty(message.author.id)
+        return
+    if not breaker.allow():
+        await reply_without_gemini(message, context_version)
+        return
+    with admission.request(message.author.id, message.content) as status:
+        if status == DUPLICATE:
+            logging.info(f"Same question from {message.author} already in progress, skipped")
+            return
+        if status != ADMITTED:
+            await send(message.channel, backpressure_messages[status].format(user=message.author.mention))
+            return
+        priority = request_priority(message)
+        try:
+            if STREAM_REPLIES:
+                chunks = gemini.stream(message.author.id, prompt, priority=priority)
+                answer = await stream_reply(message.channel, chunks, edit_interval=STREAM_EDIT_INTERVAL)
+            else:
+                response = await gemini.send(message.author.id, prompt, channel=message.channel, priority=priority)
+                answer = response.text
+                await send_long(message.channel, answer)
+        except discord.HTTPException:
+            raise  # Discord's fault, not Gemini's
+        except Exception as e:
+            logging.error(f"Erreur Gemini : {e}")
+            breaker.record_failure()
+            await reply_without_gemini(message, context_version,
+                                       interrupted=e if isinstance(e, StreamInterrupted) else None)
+            return
+        finally:
+            checkpoints.mark_dirty(message.author.id)
+    breaker.record_success()
+    answer_cache.put(message.content, context_version, answer)
+
+# Templated answer for the intents the bot knows without asking Gemini
+def local_reply(message, intents, techTalkMessage=""):
+    lines = []
+    if "time" in intents:
+        current_time = schedule.now().strftime("%H:%M:%S")
+        lines.append(f"Hello {message.author.mention}, the current time is {current_time}. 🤖")
+    if "time" in intents or "next_event" in intents:
+        lines.append(time_until_next_event())
+    if "moodle" in intents:
+        lines.append(f"🤖 Moodle link : {broadcaster.moodle_link(message.channel.id)}")
+    if "techtalk" in intents:
+        lines.append(techTalkMessage.strip() or "🤖 No tech talk scheduled today.")
+    return "\n".join(lines)
 
 # Event to listen if mentioned 
 @bot.event
@@ -279,85 +584,161 @@ async def on_message(message):
     # Check if the message is from a DM and isn't sent by the bot itself
     if isinstance(message.channel, discord.DMChannel) and message.author != bot.user:
         logging.info(f"Private message received from {message.author}: {message.content}")
-        channel_test = bot.get_channel(CHANNEL_TEST_ID)
-        if channel_test:
-            await channel_test.send(f"🤖 <@{Mehdi}> <@{Robin}> <@{Elsa}> Private message received from {message.author}: {message.content}")  # Mentionner l'utilisateur avec son ID
-        else:
-            logging.error("Le canal spécifié n'a pas été trouvé (pour test).")
-        # Reply with the current time
-        current_time = datetime.now(pytz.timezone('Europe/Brussels')).strftime("%H:%M:%S")
-        await message.reply(f"The current time is {current_time}.")
-
-        # Reply with the time remaining until the next check-in or check-out
-        time_remaining_message = time_until_next_event()
-        await message.reply(time_remaining_message)
+        # Relayed to the staff in the next digest
+        dm_relay.add(message.author, message.content)
+
+        # Reply with the current time and the time remaining until the next check-in or check-out
+        current_time = schedule.now().strftime("%H:%M:%S")
+        await reply(message, f"The current time is {current_time}.\n{time_until_next_event()}")
 
     # Check if the bot is mentioned in the message (in any channel, not just DMs)
     if bot.user.mentioned_in(message) and message.author != bot.user:
         #if message.channel.id == CHANNEL_TEST_ID:
             prompt = message.content
-            message_lower = prompt.lower()
             logging.info(f"Bot mentioned by {message.author} in {message.channel}: {message.content}")
-            if any(keyword in message_lower for keyword in ["what time", "time"]):
-                # Send a custom reply when the bot is mentioned
-                current_time = datetime.now(pytz.timezone('Europe/Brussels')).strftime("%H:%M:%S")
-                await message.channel.send(f"Hello {message.author.mention}, the current time is {current_time}. 🤖")
-                time_remaining_message = time_until_next_event()
-                await message.channel.send(time_remaining_message)
-            if any(keyword in message_lower for keyword in ["tech-talk", "tech talk"]):
-                techTalkMessage = get_techtalk_message_if_today(json_keyfile_path, sheet_url)
-                logging.info(techTalkMessage)
-                chat = get_chat_for_user(message.author.id)
-                prompt += f"Also, the use is asking about Tech talk so This is the tech talk scheduled today: {techTalkMessage}. Can you summarize or comment on it?"
-                response = chat.send_message(prompt)
-                await message.channel.send(response.text)
-            else:
+            intents = router.intents(prompt)
+            techTalkMessage = await todays_techtalk() if "techtalk" in intents else ""
+            if intents:
+                await send(message.channel, local_reply(message, intents, techTalkMessage))
+            # Only open-ended questions go to Gemini
+            if router.needs_llm(prompt, intents):
+                context_version = ""
+                if "techtalk" in intents:
+                    logging.info(techTalkMessage)
+                    prompt += f"Also, the use is asking about Tech talk so This is the tech talk scheduled today: {techTalkMessage}. Can you summarize or comment on it?"
+                    context_version = techTalkMessage
                 try:
-                    chat = get_chat_for_user(message.author.id)
-                    response = chat.send_message(prompt)
-                    reply = response.text
+                    await reply_with_gemini(message, prompt, context_version=context_version)
                 except Exception as e:
-                    logging.error(f"Erreur Gemini : {e}")
-                    reply = "⚠️ Une erreur s'est produite avec Gemini."
-                await message.channel.send(reply)
+                    logging.error(f"Erreur en répondant à {message.author} : {e}")
+                    await send(message.channel, "⚠️ Une erreur s'est produite avec Gemini.")
 
     # Always let the bot handle commands with `on_message`
     await bot.process_commands(message)
 
+# Cached role mentions are stale as soon as a guild's roles change
+@bot.event
+async def on_guild_role_create(role):
+    broadcaster.invalidate(role.guild.id)
+
+@bot.event
+async def on_guild_role_delete(role):
+    broadcaster.invalidate(role.guild.id)
+
+@bot.event
+async def on_guild_role_update(before, after):
+    broadcaster.invalidate(after.guild.id)
+
+# Background tasks that must only be started once (on_ready fires again after a reconnect)
+background_tasks = []
+# Debug mode: handlers (events, jobs, slash commands) that hold the event loop are logged with a stack sample
+blocking_detector = BlockingDetector(BLOCKING_THRESHOLD, handler_modules=(__name__,))
+
 # Event when the bot is ready
 @bot.event
 async def on_ready():
     logging.info(f'Bot connected as {bot.user}')
+    if not background_tasks:
+        startup.report("on_ready")
+        background_tasks.append(asyncio.create_task(metrics.monitor_loop_lag()))
+        if BLOCKING_THRESHOLD:
+            blocking_detector.install()
+        if METRICS_PORT:
+            background_tasks.append(await metrics.start_http_server(METRICS_PORT))
+        # Save the chats before closing on Ctrl+C / docker stop
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, lambda: asyncio.create_task(handle_exit_signal()))
     channel_test = bot.get_channel(CHANNEL_TEST_ID)
     if channel_test:
-        await channel_test.send(f"🤖 Yeah I'm still workin' no worries 🤖")  # Mentionner l'utilisateur avec son ID
+        await send(channel_test, f"🤖 Yeah I'm still workin' no worries 🤖")  # Mentionner l'utilisateur avec son ID
     else:
         logging.error("Le canal spécifié n'a pas été trouvé (pour test).")
     
     # Schedule messages using cron-style scheduling
-    for time_str in ["08:55", "11:00", "12:30", "13:25", "15:00", "17:00"]:
-        hour, minute = time_str.split(":")
+    register_schedule_jobs()
+    scheduler.add_job(
+        reload_schedule,
+        'interval',
+        minutes=1,
+        id="reload_schedule",
+        replace_existing=True
+    )
+
+    scheduler.add_job(
+        techtalk_cache.sync,
+        'interval',
+        minutes=TECHTALK_SYNC_INTERVAL,
+        id="techtalk_sync",
+        next_run_time=datetime.now(scheduler.timezone),
+        replace_existing=True
+    )
+
+    anniversaries.register_job(scheduler, timezone=schedule.timezone)
+    scheduler.add_job(
+        refresh_anniversaries_sheet,
+        'cron',
+        hour=6,
+        id="anniversaries_sheet",
+        next_run_time=datetime.now(scheduler.timezone),
+        replace_existing=True
+    )
+
+    if GEMINI_CONTEXT_CACHE_TTL:
         scheduler.add_job(
-            send_scheduled_message,
-            'cron',
-            hour=hour,
-            minute=minute,
-            args=[time_str],
-            id=f"message_{time_str}",
+            extend_persona_cache,
+            'interval',
+            seconds=max(60, GEMINI_CONTEXT_CACHE_TTL // 2),
+            id="extend_persona_cache",
             replace_existing=True
         )
-    
+    scheduler.add_job(
+        checkpoint_chats,
+        'interval',
+        seconds=CHECKPOINT_INTERVAL,
+        id="checkpoint_chats",
+        replace_existing=True
+    )
+    scheduler.add_job(
+        job_claims.prune,
+        'cron',
+        hour=3,
+        id="prune_job_claims",
+        replace_existing=True
+    )
+    scheduler.add_job(
+        admission.prune,
+        'interval',
+        minutes=10,
+        id="prune_rate_limits",
+        replace_existing=True
+    )
+    scheduler.add_job(
+        conversations.evict_idle,
+        'interval',
+        minutes=10,
+        id="evict_idle_chats",
+        replace_existing=True
+    )
+
     scheduler.start()
     await bot.tree.sync()
     logging.info("Slash commands are synced!")
-    
-    #check_birthday.start()
 
 def main():
-    #load_user_chats()
-    #signal.signal(signal.SIGINT, lambda *args: asyncio.create_task(handle_exit_signal(*args)))
-    #signal.signal(signal.SIGTERM, lambda *args: asyncio.create_task(handle_exit_signal(*args)))
+    with startup.phase("chat migration"):
+        load_user_chats()
+    if gemini_workers:
+        with startup.phase("gemini workers"):
+            gemini_workers.start()  # forked before the bot starts any thread
+    if not LAZY_INIT:
+        get_model()
+        with startup.phase("sheets authorization"):
+            get_sheets_client(json_keyfile_path).authorize()
+    startup.report("bot.run")
     bot.run(TOKEN)  # Start the bot
+    if gemini_workers:
+        gemini_workers.shutdown()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
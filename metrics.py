@@ -0,0 +1,165 @@
+import asyncio
+import functools
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def _format(name, labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return name
+    return name + "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count", "_lock")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect_left(BUCKETS, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS + (float("inf"),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+_counters = {}
+_gauges = {}
+_histograms = {}
+_lock = threading.Lock()
+
+
+def inc(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    _gauges[_key(name, labels)] = value
+
+
+def observe(name, value, **labels):
+    key = _key(name, labels)
+    histogram = _histograms.get(key)
+    if histogram is None:
+        with _lock:
+            histogram = _histograms.setdefault(key, Histogram())
+    histogram.observe(value)
+
+
+@contextmanager
+def timer(name, **labels):
+    """Record the duration of the block in the `name` histogram (errors are counted too)."""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        inc(name.removesuffix("_seconds") + "_errors_total", **labels)
+        raise
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def timed(name, **labels):
+    """Decorator version of `timer` for coroutine functions."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with timer(name, **labels):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+async def monitor_loop_lag(interval=1.0):
+    """Measure how late the event loop wakes up from a sleep (i.e. how long it was blocked)."""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = max(0.0, time.perf_counter() - start - interval)
+        set_gauge("event_loop_lag_seconds", lag)
+        observe("event_loop_lag_histogram_seconds", lag)
+
+
+def render_prometheus():
+    lines = []
+    for (name, labels), value in sorted(_counters.items()):
+        lines.append(f"{_format(name, labels)} {value}")
+    for (name, labels), value in sorted(_gauges.items()):
+        lines.append(f"{_format(name, labels)} {value}")
+    for (name, labels), histogram in sorted(_histograms.items()):
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ("+Inf",), histogram.counts):
+            cumulative += count
+            lines.append(f"{_format(name + '_bucket', labels, [('le', bound)])} {cumulative}")
+        lines.append(f"{_format(name + '_sum', labels)} {histogram.sum}")
+        lines.append(f"{_format(name + '_count', labels)} {histogram.count}")
+    return "\n".join(lines) + "\n"
+
+
+def summary():
+    """Short human-readable report for the /stats command."""
+    lines = []
+    for (name, labels), histogram in sorted(_histograms.items()):
+        if not histogram.count:
+            continue
+        avg = histogram.sum / histogram.count
+        lines.append(
+            f"{_format(name, labels)}: n={histogram.count} avg={avg * 1000:.0f}ms "
+            f"p50≤{histogram.quantile(0.5) * 1000:.0f}ms p99≤{histogram.quantile(0.99) * 1000:.0f}ms"
+        )
+    for (name, labels), value in sorted(_counters.items()):
+        lines.append(f"{_format(name, labels)}: {value}")
+    for (name, labels), value in sorted(_gauges.items()):
+        lines.append(f"{_format(name, labels)}: {value:.3f}" if isinstance(value, float) else f"{_format(name, labels)}: {value}")
+    return "\n".join(lines) or "No metrics yet."
+
+
+async def start_http_server(port, host="127.0.0.1"):
+    """Serve the metrics in Prometheus text format on http://host:port/metrics."""
+    async def handle(reader, writer):
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+            body = render_prometheus().encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    logging.info(f"📊 Metrics served on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,127 @@
+import logging
+import time
+import metrics
+
+DISCORD_LIMIT = 2000  # max characters in one Discord message
+PLACEHOLDER = "🤖 ..."
+
+
+def split_message(text, limit=DISCORD_LIMIT):
+    """Cut `text` in pieces of at most `limit` characters, on a newline or space if possible."""
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut < limit // 2:
+            cut = text.rfind(" ", 0, limit)
+        if cut < limit // 2:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip("\n ")
+    if text:
+        chunks.append(text)
+    return chunks
+
+
+async def send(channel, content):
+    # channel.send, timed
+    with metrics.timer("discord_send_seconds", op="send"):
+        return await channel.send(content)
+
+
+async def reply(message, content):
+    # message.reply, timed
+    with metrics.timer("discord_send_seconds", op="reply"):
+        return await message.reply(content)
+
+
+async def send_long(channel, text):
+    # Same as send, without failing on replies longer than Discord's limit
+    for chunk in split_message(text):
+        await send(channel, chunk)
+
+
+class StreamInterrupted(Exception):
+    """The stream of a reply failed after its placeholder was posted.
+
+    `finish(text)` turns what's on screen into a complete reply: the placeholder
+    is replaced by `text`, a partial answer is kept and `text` follows it.
+    """
+
+    def __init__(self, channel, message, text, error):
+        super().__init__(str(error))
+        self.channel = channel
+        self.message = message  # message being edited, None right after a rollover
+        self.text = text  # part of the reply received for it
+
+    async def finish(self, text):
+        if self.message is None:
+            await send_long(self.channel, text)
+            return
+        if self.text:
+            # The partial answer may be ahead of the last edit: show all of it, then `text`
+            await self._edit(self.text)
+            await send_long(self.channel, text)
+            return
+        head, *rest = split_message(text)
+        await self._edit(head)
+        for chunk in rest:
+            await send(self.channel, chunk)
+
+    async def _edit(self, content):
+        with metrics.timer("discord_send_seconds", op="edit"):
+            await self.message.edit(content=content)
+
+
+async def stream_reply(channel, chunks, edit_interval=1.0, limit=DISCORD_LIMIT):
+    """Show a streamed reply in `channel` while it's being generated.
+
+    A placeholder is posted right away and edited at most once every
+    `edit_interval` seconds (Discord allows ~5 edits per 5s per channel). When the
+    text reaches `limit`, the message is finalised and a follow-up message is started.
+    Returns the full reply text. If `chunks` fails, StreamInterrupted is raised
+    so the caller can finish the reply (see StreamInterrupted.finish).
+    """
+    start = time.perf_counter()
+    message = await send(channel, PLACEHOLDER)
+    first_visible = None
+    full = []
+    current = ""  # text of the message being edited
+    shown = PLACEHOLDER
+    last_edit = start
+
+    async def show(text):
+        nonlocal message, shown, last_edit, first_visible
+        if message is None:
+            message = await send(channel, text)  # follow-up after a rollover
+        else:
+            with metrics.timer("discord_send_seconds", op="edit"):
+                await message.edit(content=text)
+        shown = text
+        last_edit = time.perf_counter()
+        if first_visible is None:
+            first_visible = last_edit - start
+
+    iterator = aiter(chunks)
+    while True:
+        try:
+            chunk = await anext(iterator)
+        except StopAsyncIteration:
+            break
+        except Exception as e:
+            raise StreamInterrupted(channel, message, current, e) from e
+        full.append(chunk)
+        current += chunk
+        while len(current) > limit:
+            head = split_message(current, limit)[0]
+            await show(head)
+            current = current[len(head):].lstrip("\n ")
+            message, shown = None, ""
+        if current and current != shown and (first_visible is None or time.perf_counter() - last_edit >= edit_interval):
+            await show(current)
+
+    if current != shown and (current or message is not None):
+        await show(current or "🤖")
+    total = time.perf_counter() - start
+    metrics.observe("stream_first_visible_seconds", first_visible or total)
+    logging.info(f"⏱️ Streamed reply: first text visible after {first_visible or total:.2f}s, complete after {total:.2f}s")
+    return "".join(full)
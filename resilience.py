@@ -0,0 +1,251 @@
+import logging
+import queue
+import threading
+import time
+import metrics
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class BackendUnavailable(Exception):
+    """Gemini didn't answer in time, or is considered down (circuit open)."""
+
+
+class CircuitBreaker:
+    """Stops calling a backend that keeps failing.
+
+    After `failure_threshold` consecutive failures the circuit opens: `allow()`
+    is False for `reset_timeout` seconds, so callers answer right away with a
+    fallback instead of waiting for another timeout. Then a single request is
+    let through as a probe; its success closes the circuit, a failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probe_at = 0.0
+        self._lock = threading.Lock()
+
+    def _set_state(self, state):
+        if state != self.state:
+            logging.warning(f"🔌 Gemini circuit {self.state} -> {state}")
+            self.state = state
+            metrics.set_gauge("gemini_circuit_open", int(state != CLOSED))
+
+    def allow(self):
+        with self._lock:
+            now = time.monotonic()
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and now - self._opened_at >= self.reset_timeout:
+                self._set_state(HALF_OPEN)
+                self._probe_at = now
+                return True
+            if self.state == HALF_OPEN and now - self._probe_at >= self.reset_timeout:
+                self._probe_at = now  # the last probe never reported back
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._set_state(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._set_state(OPEN)
+
+
+class ResilientChat:
+    """ChatSession wrapper with a deadline and optional hedging to a fallback model.
+
+    Each attempt runs on a copy of the session, in its own thread, and only the
+    winner's history is copied back, so a late or abandoned reply never ends up
+    in the conversation. If the primary model hasn't started answering after
+    `hedge_after` seconds (or fails), the same request is sent to
+    `fallback_model()`, and the first one to answer is used. When nothing comes
+    for `deadline` seconds (before the first chunk or between two chunks),
+    BackendUnavailable is raised.
+
+    Each attempt is sent with a `timeout`, so one that was abandoned still ends.
+    With `slots` (the GeminiDispatcher running the request), attempts count
+    against its global cap: the primary keeps the request's slot busy until it
+    really ends, and the hedge waits for a slot of its own.
+    """
+
+    def __init__(self, chat, deadline=30.0, hedge_after=None, fallback_model=None, timeout=60.0, slots=None):
+        self.chat = chat
+        self.deadline = deadline
+        self.hedge_after = hedge_after if fallback_model is not None else None
+        self.fallback_model = fallback_model
+        self.timeout = timeout
+        self.slots = slots
+
+    @property
+    def history(self):
+        return self.chat.history
+
+    @history.setter
+    def history(self, history):
+        self.chat.history = history
+
+    def _attempt(self, name, model, history, prompt, stream, results):
+        # Thread: puts (name, kind, value) items, kind is "chunk", "done" or "error"
+        clone = model.start_chat(history=history)
+        options = {"timeout": self.timeout}
+        try:
+            if stream:
+                for chunk in clone.send_message(prompt, stream=True, request_options=options):
+                    results.put((name, "chunk", chunk))
+            else:
+                results.put((name, "chunk", clone.send_message(prompt, request_options=options)))
+            results.put((name, "done", clone))
+        except Exception as e:
+            results.put((name, "error", e))
+
+    def _primary(self, lease, *args):
+        try:
+            self._attempt(*args)
+        finally:
+            if lease is not None:
+                lease.release()
+
+    def _hedge(self, lease, over, *args):
+        with self.slots.extra_slot(lease):
+            if not over.is_set():  # no use asking once the request has been answered or abandoned
+                self._attempt(*args)
+
+    def _chunks(self, prompt, stream):
+        history = list(self.chat.history)
+        results = queue.Queue()
+        over = threading.Event()
+        lease = self.slots.current_lease() if self.slots is not None else None
+
+        def start(name, model):
+            args = (name, model, history, prompt, stream, results)
+            if name == "primary":
+                if lease is not None:
+                    lease.hold()
+                target, args = self._primary, (lease, *args)
+            elif lease is not None:
+                target, args = self._hedge, (lease, over, *args)
+            else:
+                target = self._attempt
+            threading.Thread(target=target, args=args, name=f"gemini-{name}", daemon=True).start()
+            running.add(name)
+
+        running = set()
+        try:
+            yield from self._race(start, running, results)
+        finally:
+            over.set()
+
+    def _race(self, start, running, results):
+        start("primary", self.chat.model)
+        began = last_progress = time.perf_counter()
+        hedged = self.hedge_after is None  # nothing to hedge to
+        winner = None
+        error = None
+        while True:
+            now = time.perf_counter()
+            if not hedged and winner is None and (now - began >= self.hedge_after or not running):
+                if running:
+                    logging.warning(f"⏱️ No Gemini reply after {now - began:.1f}s, hedging to the fallback model")
+                else:
+                    logging.warning("↪️ Retrying the failed Gemini request on the fallback model")
+                metrics.inc("gemini_hedges_total")
+                hedged = True
+                start("fallback", self.fallback_model())
+                continue
+            if not running:
+                raise error
+            # The deadline is on silence: before the first chunk, then between chunks
+            timeout = self.deadline - (now - last_progress)
+            if not hedged and winner is None:
+                timeout = min(timeout, self.hedge_after - (now - began))
+            try:
+                name, kind, value = results.get(timeout=max(0.0, timeout))
+            except queue.Empty:
+                if time.perf_counter() - last_progress >= self.deadline:
+                    metrics.inc("gemini_deadline_exceeded_total")
+                    raise BackendUnavailable(f"no reply from Gemini for {self.deadline:.0f}s")
+                continue
+            if winner is not None and name != winner:
+                continue  # the other attempt lost, its results are dropped
+            if kind == "error":
+                logging.error(f"❌ Gemini {name} attempt failed: {value}")
+                if winner is not None:
+                    raise value  # part of the reply was already given
+                running.discard(name)
+                error = value
+                continue
+            if winner is None:
+                winner = name
+                if name == "fallback":
+                    metrics.inc("gemini_hedge_wins_total")
+            last_progress = time.perf_counter()
+            if kind == "done":
+                self.chat.history = value.history
+                return
+            yield value
+
+    def send_message(self, prompt, stream=False):
+        if stream:
+            return self._chunks(prompt, stream=True)
+        response = None
+        for response in self._chunks(prompt, stream=False):
+            pass
+        return response
+
+
+if __name__ == "__main__":
+    # Local check with fake models: a stalled primary is hedged to the fallback,
+    # and a dead backend opens the circuit after a few failures.
+    class FakeResponse:
+        def __init__(self, text):
+            self.text = text
+
+    class FakeChat:
+        def __init__(self, model, history):
+            self.model = model
+            self.history = list(history or [])
+
+        def send_message(self, prompt, stream=False, request_options=None):
+            time.sleep(self.model.latency)
+            if self.model.fails:
+                raise RuntimeError("fake Gemini error")
+            self.history += [{"role": "user", "parts": [prompt]}, {"role": "model", "parts": [self.model.name]}]
+            return FakeResponse(f"{self.model.name}: {prompt}")
+
+    class FakeModel:
+        def __init__(self, name, latency, fails=False):
+            self.name, self.latency, self.fails = name, latency, fails
+
+        def start_chat(self, history=None):
+            return FakeChat(self, history)
+
+    fallback = FakeModel("flash-lite", 0.2)
+    chat = ResilientChat(FakeModel("flash", 3.0).start_chat(), deadline=5, hedge_after=0.5, fallback_model=lambda: fallback)
+    start = time.perf_counter()
+    print(f"{chat.send_message('hello').text!r} in {time.perf_counter() - start:.2f}s, history {chat.history}")
+
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+    chat = ResilientChat(FakeModel("flash", 0.1, fails=True).start_chat(), deadline=5)
+    for i in range(5):
+        if not breaker.allow():
+            print(f"request {i}: circuit {breaker.state}, answered without Gemini")
+            continue
+        try:
+            chat.send_message(f"question {i}")
+            breaker.record_success()
+        except Exception as e:
+            breaker.record_failure()
+            print(f"request {i}: {e}")
@@ -0,0 +1,150 @@
+import json
+import logging
+import os
+from bisect import bisect_right
+from datetime import date, datetime
+import pytz
+
+WEEKDAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+
+class Timeline:
+    """One day of events, sorted by time.
+
+    `seconds[i]` is the time of slot i in seconds since midnight, `kinds[i]` the
+    event kinds at that time and `labels[i]` the one shown by "next event".
+    """
+
+    __slots__ = ("seconds", "kinds", "labels", "by_time")
+
+    def __init__(self, events):
+        slots = {}
+        for kind, times in events.items():
+            for time_str in times:
+                hour, minute = map(int, time_str.split(":"))
+                slots.setdefault(hour * 3600 + minute * 60, set()).add(kind)
+        ordered = sorted(slots)
+        self.seconds = tuple(ordered)
+        self.kinds = tuple(frozenset(slots[s]) for s in ordered)
+        self.labels = tuple(min(slots[s]) for s in ordered)
+        self.by_time = {f"{s // 3600:02d}:{s % 3600 // 60:02d}": k for s, k in zip(self.seconds, self.kinds)}
+
+
+_EMPTY = Timeline({})
+
+
+class Schedule:
+    """The bootcamp day, compiled once from a JSON config file.
+
+    Holds one timeline per weekday (days off get an empty one), a set of
+    holidays, and registers one APScheduler cron job per distinct event time.
+    `reload_if_changed()` picks up edits of the file without restarting the bot.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._mtime = None
+        self._job_ids = {}  # job prefix -> ids of its cron jobs
+        self._load()
+
+    def _load(self):
+        mtime = os.path.getmtime(self.path)
+        with open(self.path, encoding="utf-8") as f:
+            config = json.load(f)
+        timezone = pytz.timezone(config.get("timezone", "Europe/Brussels"))
+        workdays = set(config.get("weekdays", WEEKDAYS[:5]))
+        overrides = config.get("weekday_events", {})
+        timelines = []
+        for day in WEEKDAYS:
+            if day not in workdays:
+                timelines.append(_EMPTY)
+            else:
+                timelines.append(Timeline(overrides.get(day, config["events"])))
+        holidays = frozenset(date.fromisoformat(d) for d in config.get("holidays", []))
+        # Swap everything at once so lookups never see a half-loaded schedule
+        self.timezone, self.timelines, self.holidays, self._mtime = timezone, tuple(timelines), holidays, mtime
+
+    def reload_if_changed(self):
+        try:
+            if os.path.getmtime(self.path) == self._mtime:
+                return False
+            self._load()
+        except (OSError, ValueError, KeyError) as e:
+            logging.error(f"❌ Invalid schedule in {self.path}, keeping the previous one: {e}")
+            return False
+        logging.info(f"🔄 Schedule reloaded from {self.path}")
+        return True
+
+    def now(self):
+        return datetime.now(self.timezone)
+
+    def timeline(self, day):
+        if day in self.holidays:
+            return _EMPTY
+        return self.timelines[day.weekday()]
+
+    def kinds_at(self, day, time_str):
+        """Event kinds scheduled at "HH:MM" on `day` (empty on days off and holidays)."""
+        return self.timeline(day).by_time.get(time_str, frozenset())
+
+    def next_event(self, now):
+        """(seconds until the next event, its label) today, or None if the day is over."""
+        timeline = self.timeline(now.date())
+        current = now.hour * 3600 + now.minute * 60 + now.second
+        i = bisect_right(timeline.seconds, current)
+        if i == len(timeline.seconds):
+            return None
+        remaining = timeline.seconds[i] - current - (1 if now.microsecond else 0)
+        return remaining, timeline.labels[i]
+
+    def _days_by_time(self, kind=None):
+        # "HH:MM" -> weekdays with a slot at that time (with an event of `kind`, if given)
+        days_by_time = {}
+        for day, timeline in zip(WEEKDAYS, self.timelines):
+            for time_str, kinds in timeline.by_time.items():
+                if kind is None or kind in kinds:
+                    days_by_time.setdefault(time_str, []).append(day)
+        return days_by_time
+
+    def _register(self, scheduler, func, prefix, jobs):
+        # jobs: (job time "HH:MM", days, args); replaces the previous jobs of `prefix`
+        job_ids = set()
+        for time_str, days, args in jobs:
+            hour, minute = time_str.split(":")
+            job_id = f"{prefix}_{time_str}"
+            scheduler.add_job(
+                func,
+                'cron',
+                day_of_week=",".join(days),
+                hour=hour,
+                minute=minute,
+                args=args,
+                timezone=self.timezone,
+                id=job_id,
+                replace_existing=True
+            )
+            job_ids.add(job_id)
+        # Drop the jobs of times that are no longer in the schedule
+        for job_id in self._job_ids.get(prefix, set()) - job_ids:
+            if scheduler.get_job(job_id):
+                scheduler.remove_job(job_id)
+        self._job_ids[prefix] = job_ids
+
+    def register_jobs(self, scheduler, func):
+        """Add (or replace) one cron job per event time, calling func("HH:MM").
+
+        Times are in the schedule's timezone, whatever the scheduler's is.
+        """
+        jobs = [(time_str, days, [time_str]) for time_str, days in sorted(self._days_by_time().items())]
+        self._register(scheduler, func, "message", jobs)
+
+    def register_before(self, scheduler, func, kind, minutes, prefix):
+        """Add (or replace) cron jobs calling func() `minutes` before each `kind` event
+        (e.g. to warm a cache before the post), on the days it happens.
+        """
+        jobs = []
+        for time_str, days in sorted(self._days_by_time(kind).items()):
+            hour, minute = map(int, time_str.split(":"))
+            start = max(0, hour * 60 + minute - minutes)  # not before midnight
+            jobs.append((f"{start // 60:02d}:{start % 60:02d}", days, []))
+        self._register(scheduler, func, prefix, jobs)
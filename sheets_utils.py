@@ -1,62 +1,159 @@
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+import asyncio
+import logging
+import threading
+import time
 from datetime import datetime
+from techtalk_index import parse_talks
+import metrics
+
+SCOPE = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
+
+
+class SheetsClient:
+    """Long-lived gspread client: credentials are loaded and authorized once.
+
+    gspread and oauth2client are only imported on the first authorization, so
+    they don't slow down the bot's startup.
+    """
+
+    def __init__(self, json_keyfile_path):
+        self.json_keyfile_path = json_keyfile_path
+        self._client = None
+        self._spreadsheets = {}
+        self._lock = threading.Lock()
+
+    def _authorize(self):
+        if self._client is None:
+            import gspread
+            from oauth2client.service_account import ServiceAccountCredentials
+            creds = ServiceAccountCredentials.from_json_keyfile_name(self.json_keyfile_path, SCOPE)
+            self._client = gspread.authorize(creds)
+        return self._client
+
+    def authorize(self):
+        with self._lock:
+            return self._authorize()
+
+    def spreadsheet(self, sheet_url):
+        with self._lock:
+            self._authorize()
+            if sheet_url not in self._spreadsheets:
+                self._spreadsheets[sheet_url] = self._client.open_by_url(sheet_url)
+            return self._spreadsheets[sheet_url]
+
+    def worksheet(self, sheet_url):
+        return self.spreadsheet(sheet_url).sheet1
+
+
+_clients = {}
+
+
+def get_sheets_client(json_keyfile_path):
+    if json_keyfile_path not in _clients:
+        _clients[json_keyfile_path] = SheetsClient(json_keyfile_path)
+    return _clients[json_keyfile_path]
+
+
+def format_talks(talks):
+    messages = [
+        f"\n🎤 TECH-TALK ALERT 🎤\n"
+        f"Learner: {talk['learner']}\n"
+        f"Theme: {talk['theme']}\n"
+        f"Voice: {talk['voice']}\n"
+        f"Slides: {talk['slides']}\n"
+        f"Body Language: {talk['body_language']}"
+        for talk in talks
+    ]
+    return "\n\n".join(messages)
+
+
+def format_techtalk_messages(sheet, day):
+    # Whole sheet at once, headers merged and dates parsed (see techtalk_index.parse_talks)
+    talks = parse_talks(sheet.get_all_values())
+    return format_talks([talk for talk in talks if talk["date"] == day])
+
 
 def get_techtalk_message_if_today(json_keyfile_path, sheet_url):
-    # Autorisations Google Sheets
-    scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
-    creds = ServiceAccountCredentials.from_json_keyfile_name(json_keyfile_path, scope)
-    client = gspread.authorize(creds)
-
-    # Ouverture de la feuille
-    sheet = client.open_by_url(sheet_url).sheet1
-    
-    # Afficher les en-têtes réelles pour identifier le problème
-    headers = sheet.row_values(2)  # Utiliser la 2ème ligne pour les en-têtes
-    print("Actual Headers in Sheet:", headers)  # Afficher les en-têtes réelles
-
-    # Identifier la position des colonnes spécifiques
-    date_idx = headers.index('Date') if 'Date' in headers else -1
-    learner_idx = headers.index('Learner') if 'Learner' in headers else -1
-    theme_idx = headers.index('Theme') if 'Theme' in headers else -1
-    feedback_idx = headers.index('Feedback_') if 'Feedback_' in headers else -1
-    
-    # Rechercher les colonnes sous Feedback_
-    voice_idx = headers.index('Voice') if 'Voice' in headers else -1
-    slides_idx = headers.index('Slides') if 'Slides' in headers else -1
-    body_lang_idx = headers.index('Body Language') if 'Body Language' in headers else -1
-
-    # Récupération des données sous forme de dictionnaires avec en-têtes spécifiées
-    records = sheet.get_all_records(head=2, expected_headers=headers)  # Passer les en-têtes attendus
-
-    # Date du jour au format attendu
-    today_str = datetime.today().strftime('%-d/%-m/%y')
-    print(f"Today's date: {today_str}")  # Pour déboguer
-
-    messages = []
-
-    for row in records:
-        # Accéder aux valeurs par index
-        date_value = str(row.get(headers[date_idx], "")).strip() if date_idx != -1 else ""
-        learner = row.get(headers[learner_idx], "N/A") if learner_idx != -1 else "N/A"
-        theme = row.get(headers[theme_idx], "N/A") if theme_idx != -1 else "N/A"
-        voice = row.get(headers[voice_idx], "N/A") if voice_idx != -1 else "N/A"
-        slides = row.get(headers[slides_idx], "N/A") if slides_idx != -1 else "N/A"
-        body_lang = row.get(headers[body_lang_idx], "N/A") if body_lang_idx != -1 else "N/A"
-        
-        # Vérifie si la date correspond à aujourd'hui
-        if date_value == today_str:
-            msg = (
-                f"\n🎤 TECH-TALK ALERT 🎤\n"
-                f"Learner: {learner}\n"
-                f"Theme: {theme}\n"
-                f"Voice: {voice}\n"
-                f"Slides: {slides}\n"
-                f"Body Language: {body_lang}"
-            )
-            messages.append(msg)
-    print(messages)
-    return "\n\n".join(messages) if messages else ""
+    with metrics.timer("sheets_fetch_seconds"):
+        sheet = get_sheets_client(json_keyfile_path).worksheet(sheet_url)
+        return format_techtalk_messages(sheet, datetime.today().date())
+
+
+class TechTalkCache:
+    """Tech-talk message per date, kept in memory for `ttl` seconds.
+
+    The sheet itself is mirrored in `index` (a TechTalkIndex): a sync only
+    downloads it again when its revision (last update time) changed, and every
+    message or query is then answered from the local copy. `refresh()` is meant
+    to run in the background (e.g. a few minutes before the 13:25 post) so that
+    `get()` is served from memory instead of Google.
+    """
+
+    def __init__(self, json_keyfile_path, sheet_url, index, ttl=3600):
+        self.json_keyfile_path = json_keyfile_path
+        self.sheet_url = sheet_url
+        self.index = index
+        self.ttl = ttl
+        self._entries = {}  # date -> (message, fetched_at)
+        self._refreshing = {}
+        self._sync_lock = threading.Lock()
+        self.fetches = 0
+
+    def _sync(self):
+        with self._sync_lock:
+            spreadsheet = get_sheets_client(self.json_keyfile_path).spreadsheet(self.sheet_url)
+            revision = spreadsheet.get_lastUpdateTime()
+            if revision == self.index.revision():
+                metrics.inc("techtalk_sync_skipped_total")
+                return False
+            with metrics.timer("sheets_fetch_seconds"):
+                values = spreadsheet.sheet1.get_all_values()
+            self.index.replace(parse_talks(values), revision)
+            self.fetches += 1
+            self._entries.clear()
+            return True
+
+    async def sync(self):
+        """Bring the local copy up to date; True if the sheet had changed."""
+        try:
+            return await asyncio.to_thread(self._sync)
+        except Exception as e:
+            logging.error(f"❌ Tech talk sheet sync failed: {e}")
+            return False
+
+    def _fetch(self, day):
+        try:
+            self._sync()
+        except Exception as e:
+            if self.index.revision() is None:
+                raise
+            logging.error(f"❌ Tech talk sheet sync failed, using the local copy: {e}")
+        return format_talks(self.index.on(day))
+
+    async def refresh(self, day=None):
+        day = day or datetime.today().date()
+        # Several callers during a miss share the same sync
+        task = self._refreshing.get(day)
+        if task is None:
+            task = asyncio.ensure_future(asyncio.to_thread(self._fetch, day))
+            self._refreshing[day] = task
+            try:
+                message = await task
+                self._entries[day] = (message, time.monotonic())
+                logging.info(f"📥 Tech talk cache refreshed for {day}")
+                return message
+            finally:
+                del self._refreshing[day]
+        return await task
+
+    async def get(self, day=None):
+        day = day or datetime.today().date()
+        entry = self._entries.get(day)
+        if entry is not None and time.monotonic() - entry[1] < self.ttl:
+            metrics.inc("techtalk_cache_hits_total")
+            return entry[0]
+        metrics.inc("techtalk_cache_misses_total")
+        return await self.refresh(day)
 
 
 if __name__ == "__main__":
@@ -68,4 +165,4 @@ if __name__ == "__main__":
         print("Tech Talk Message(s) for Today:")
         print(techtalk_message)
     else:
-        print("No tech talks scheduled for today.")
\ No newline at end of file
+        print("No tech talks scheduled for today.")
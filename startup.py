@@ -0,0 +1,64 @@
+import builtins
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+# STARTUP_PROFILE=1 prints where the time goes between `python main.py` and on_ready
+ENABLED = os.getenv("STARTUP_PROFILE", "0") == "1"
+
+_start = time.perf_counter()
+_phases = []  # (name, seconds)
+_imports = {}  # top-level package -> seconds spent importing it
+_depth = 0
+
+
+def _timed_import(name, *args, **kwargs):
+    global _depth
+    package = name.partition(".")[0]
+    if _depth or package in sys.modules or (len(args) > 3 and args[3]):
+        # Nested, already loaded or relative: counted by the outer import
+        return _real_import(name, *args, **kwargs)
+    _depth += 1
+    start = time.perf_counter()
+    try:
+        return _real_import(name, *args, **kwargs)
+    finally:
+        _depth -= 1
+        _imports[package] = _imports.get(package, 0) + time.perf_counter() - start
+
+
+_real_import = builtins.__import__
+if ENABLED:
+    builtins.__import__ = _timed_import
+
+
+def elapsed():
+    return time.perf_counter() - _start
+
+
+@contextmanager
+def phase(name):
+    """Time one initialization step (a no-op unless STARTUP_PROFILE=1)."""
+    if not ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _phases.append((name, time.perf_counter() - start))
+
+
+def report(milestone):
+    """Log the import and initialization breakdown up to `milestone` (e.g. "on_ready")."""
+    if not ENABLED:
+        return
+    builtins.__import__ = _real_import  # only startup imports are of interest
+    lines = [f"⏱️ Startup profile: {milestone} after {elapsed():.2f}s"]
+    for package, seconds in sorted(_imports.items(), key=lambda item: -item[1])[:10]:
+        lines.append(f"  import {package:<30}{seconds * 1000:>8.0f} ms")
+    for name, seconds in _phases:
+        lines.append(f"  {name:<37}{seconds * 1000:>8.0f} ms")
+    logging.info("\n".join(lines))
@@ -0,0 +1,120 @@
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+
+COLUMNS = {"Date": "date", "Learner": "learner", "Theme": "theme", "Voice": "voice", "Slides": "slides",
+           "Body Language": "body_language"}
+DATE_FORMATS = ("%d/%m/%y", "%d/%m/%Y", "%Y-%m-%d")
+
+
+def merge_headers(header_row1, header_row2):
+    # The sheet has two header rows ("Feedback_" above Voice, Slides, ...): the second wins
+    headers = []
+    for h1, h2 in zip(header_row1, header_row2):
+        if h2.strip():
+            headers.append(h2.strip())
+        elif h1.strip():
+            headers.append(h1.strip())
+        else:
+            headers.append("Unknown")
+    return headers
+
+
+def parse_date(value):
+    value = str(value).strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            pass
+    return None
+
+
+def parse_talks(values):
+    """Tech talks from the sheet's `get_all_values()`: a dict per row, keyed by COLUMNS' values.
+
+    Empty cells become "N/A" and `date` is a date object (None if it can't be read).
+    """
+    if len(values) < 2:
+        return []
+    headers = merge_headers(values[0], values[1])
+    indexes = {key: headers.index(header) for header, key in COLUMNS.items() if header in headers}
+    talks = []
+    for row in values[2:]:
+        if not any(cell.strip() for cell in row):
+            continue
+        talk = {key: (row[i].strip() if i < len(row) and row[i].strip() else "N/A") for key, i in indexes.items()}
+        talk["date"] = parse_date(talk.get("date", ""))
+        talks.append(talk)
+    return talks
+
+
+class TechTalkIndex:
+    """Local copy of the tech-talk sheet in SQLite, indexed by date and by learner.
+
+    `replace()` swaps the whole content in one transaction, tagged with the
+    sheet's revision so a sync can tell when there's nothing new to download.
+    """
+
+    FIELDS = ("date", "learner", "theme", "voice", "slides", "body_language")
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS talks ("
+                " date TEXT, learner TEXT NOT NULL, learner_key TEXT NOT NULL, theme TEXT,"
+                " voice TEXT, slides TEXT, body_language TEXT)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS talks_date ON talks (date)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS talks_learner ON talks (learner_key)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def revision(self):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'revision'").fetchone()
+        return row[0] if row else None
+
+    def replace(self, talks, revision):
+        rows = [
+            (talk["date"].isoformat() if talk.get("date") else None, talk.get("learner", "N/A"),
+             talk.get("learner", "N/A").casefold(), talk.get("theme", "N/A"), talk.get("voice", "N/A"),
+             talk.get("slides", "N/A"), talk.get("body_language", "N/A"))
+            for talk in talks
+        ]
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM talks")
+            self._conn.executemany("INSERT INTO talks VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('revision', ?)", (revision,))
+        logging.info(f"📥 Tech talk index rebuilt: {len(rows)} talks (revision {revision})")
+
+    def _select(self, where, params):
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(self.FIELDS)} FROM talks WHERE {where} ORDER BY date, learner", params
+            ).fetchall()
+        talks = []
+        for row in rows:
+            talk = dict(zip(self.FIELDS, row))
+            talk["date"] = datetime.strptime(talk["date"], "%Y-%m-%d").date() if talk["date"] else None
+            talks.append(talk)
+        return talks
+
+    def on(self, day):
+        return self._select("date = ?", (day.isoformat(),))
+
+    def between(self, start, end):
+        """Talks from `start` to `end`, both included."""
+        return self._select("date BETWEEN ? AND ?", (start.isoformat(), end.isoformat()))
+
+    def by_learner(self, name):
+        # Exact name first (indexed), else any learner whose name contains it
+        key = name.strip().casefold()
+        return self._select("learner_key = ?", (key,)) or self._select("instr(learner_key, ?) > 0", (key,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
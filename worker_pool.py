@@ -0,0 +1,139 @@
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from chat_store import open_chat_store, to_turn
+from conversation import fit_to_budget
+from gemini_dispatch import GeminiDispatcher, record_request, request_stats
+import metrics
+from resilience import BackendUnavailable
+
+# State of the current worker process, set up once by _init_worker
+_worker = {}
+
+
+def _init_worker(store_path, model_factory, token_budget):
+    _worker["store"] = open_chat_store(store_path)
+    _worker["model"] = model_factory()
+    _worker["token_budget"] = token_budget
+
+
+def worker_send(user_id, prompt, system_bytes=0):
+    """Runs in a worker: one Gemini exchange on the history from the shared store.
+
+    Returns the reply text and its request_stats (recorded by the bot process).
+    """
+    history, _, _ = fit_to_budget(_worker["store"].load(user_id), _worker["token_budget"])
+    chat = _worker["model"].start_chat(history=history)
+    response = chat.send_message(prompt)
+    _worker["store"].append(user_id, [to_turn(msg) for msg in chat.history[len(history):]])
+    return response.text, request_stats(history, prompt, response, system_bytes)
+
+
+def worker_remember(user_id, prompt, reply):
+    _worker["store"].append(user_id, [{"role": "user", "parts": [prompt]}, {"role": "model", "parts": [reply]}])
+
+
+def _ready():
+    return os.getpid()
+
+
+class WorkerResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class GeminiWorkerPool:
+    """Processes that make the Gemini calls, sharing the chat store with the bot.
+
+    Nothing of a conversation is kept in the workers: each request loads the
+    user's history from the (SQLite) store and appends the new turns to it, so
+    any worker can serve any user. `start()` launches the processes; call it
+    before the bot starts its threads when using the "fork" start method.
+    """
+
+    def __init__(self, workers, store_path, model_factory, token_budget=8000, start_method="fork"):
+        self.workers = workers
+        self.store_path = store_path
+        self.model_factory = model_factory
+        self.token_budget = token_budget
+        self.start_method = start_method
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            return self._start()
+
+    def _start(self):
+        if self._executor is None:
+            start = time.perf_counter()
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context(self.start_method),
+                initializer=_init_worker,
+                initargs=(self.store_path, self.model_factory, self.token_budget),
+            )
+            for future in [self._executor.submit(_ready) for _ in range(self.workers)]:
+                future.result()
+            logging.info(f"🏭 {self.workers} Gemini worker processes ready in {time.perf_counter() - start:.2f}s")
+        return self._executor
+
+    def submit(self, func, *args):
+        return self.start().submit(func, *args)
+
+    def call(self, func, *args, timeout=None):
+        # Blocking: called from one of the dispatcher's threads
+        return self.submit(func, *args).result(timeout=timeout)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+
+class ProcessGeminiDispatcher(GeminiDispatcher):
+    """GeminiDispatcher whose calls run in a GeminiWorkerPool instead of this process.
+
+    Ordering per user, the global cap and the priorities are unchanged (the
+    dispatcher's threads just wait for the workers). Replies are not streamed:
+    `stream()` yields the whole text once it's complete. A reply that takes
+    more than `deadline` seconds raises BackendUnavailable (the worker still
+    finishes it and stores it in the history).
+
+    The cap is at most one request per worker, and an abandoned request keeps
+    its slot until its worker is done with it: requests wait for a slot in the
+    dispatcher (by priority), never in the pool's queue, so the deadline only
+    counts the time a worker spends on the request.
+    """
+
+    def __init__(self, pool, max_in_flight=4, system_bytes=lambda: 0, deadline=None):
+        super().__init__(get_chat=None, max_in_flight=min(max_in_flight, pool.workers), system_bytes=system_bytes)
+        self.pool = pool
+        self.deadline = deadline
+
+    def _call(self, user_id, prompt):
+        future = self.pool.submit(worker_send, user_id, prompt, self.system_bytes())
+        try:
+            text, stats = future.result(timeout=self.deadline)
+        except TimeoutError:
+            lease = self.current_lease()
+            if lease is not None:
+                lease.hold()
+                future.add_done_callback(lambda _: lease.release())
+            metrics.inc("gemini_deadline_exceeded_total")
+            raise BackendUnavailable(f"no reply from the Gemini worker in {self.deadline:.0f}s")
+        record_request(stats)
+        return text
+
+    def _send_sync(self, user_id, prompt):
+        with metrics.timer("gemini_request_seconds", mode="worker"):
+            return WorkerResponse(self._call(user_id, prompt))
+
+    def _stream_sync(self, user_id, prompt, loop, queue):
+        loop.call_soon_threadsafe(queue.put_nowait, self._call(user_id, prompt))
+
+    def _remember_sync(self, user_id, prompt, reply):
+        self.pool.call(worker_remember, user_id, prompt, reply)